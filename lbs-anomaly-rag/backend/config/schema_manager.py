@@ -1,7 +1,9 @@
 """Schema Configuration Manager - Loads and manages database schema configuration"""
 import json
 import os
-from typing import Dict, List, Any
+import threading
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Collection
 
 
 class SchemaManager:
@@ -40,13 +42,18 @@ class SchemaManager:
         """Get business rules"""
         return self.config.get('business_rules', [])
 
-    def generate_schema_context_text(self) -> str:
+    def generate_schema_context_text(self, tables: Optional[Collection[str]] = None) -> str:
         """
         Generate a human-readable schema context for LLM
 
+        Args:
+            tables: Only describe these tables (None for all)
+
         Returns:
             Formatted schema description text
         """
+        fact_tables = [t for t in self.get_fact_tables() if tables is None or t['name'] in tables]
+        dimension_tables = [t for t in self.get_dimension_tables() if tables is None or t['name'] in tables]
         lines = []
 
         # Header
@@ -59,7 +66,7 @@ class SchemaManager:
         # Fact Tables
         lines.append("## Fact Tables")
         lines.append("")
-        for fact in self.get_fact_tables():
+        for fact in fact_tables:
             lines.append(f"### {fact['name']} ({fact['row_count']:,} rows)")
             lines.append(fact['description'])
             lines.append("")
@@ -100,7 +107,7 @@ class SchemaManager:
         # Dimension Tables
         lines.append("## Dimension Tables")
         lines.append("")
-        for dim in self.get_dimension_tables():
+        for dim in dimension_tables:
             lines.append(f"### {dim['name']} ({dim['row_count']:,} rows)")
             lines.append(dim['description'])
             lines.append("")
@@ -163,7 +170,7 @@ class SchemaManager:
         # Table Aliases
         lines.append("## Table Alias Reference")
         lines.append("")
-        for table in self.get_fact_tables() + self.get_dimension_tables():
+        for table in fact_tables + dimension_tables:
             lines.append(f"- {table['name']}: `{table['alias']}`")
 
         return "\n".join(lines)
@@ -207,8 +214,15 @@ class SchemaManager:
 
         return columns
 
-    def get_joins_text(self) -> str:
-        """Generate common join patterns"""
+    def get_table_search_text(self, table_name: str) -> str:
+        """Short description of a table and its columns, for matching questions to tables"""
+        table = self.get_table_by_name(table_name)
+        if not table:
+            return ""
+        return f"{table['name']}: {table['description']}. Columns: {', '.join(self.get_column_list(table_name))}"
+
+    def get_joins_text(self, tables: Optional[Collection[str]] = None) -> str:
+        """Generate common join patterns (only between the given tables, if any)"""
         lines = []
         lines.append("## Common Join Patterns")
         lines.append("")
@@ -220,7 +234,7 @@ class SchemaManager:
             for fk in fact.get('foreign_keys', []):
                 dim_table = fk['references'].split('.')[0]
                 dim = self.get_table_by_name(dim_table)
-                if dim:
+                if dim and (tables is None or dim_table in tables):
                     lines.append(f"**{fact_name} to {dim_table}:**")
                     lines.append("```sql")
                     lines.append(f"FROM {fact_name} {fact_alias}")
@@ -233,23 +247,38 @@ class SchemaManager:
 
 # Global instance
 _schema_manager = None
+_schema_manager_lock = threading.Lock()
 
 
 def get_schema_manager() -> SchemaManager:
-    """Get singleton schema manager instance"""
+    """Get singleton schema manager instance (schema_config.json is read on first use)"""
     global _schema_manager
     if _schema_manager is None:
-        _schema_manager = SchemaManager()
+        with _schema_manager_lock:
+            if _schema_manager is None:
+                _schema_manager = SchemaManager()
     return _schema_manager
 
 
 # Convenience functions for backward compatibility
+@lru_cache(maxsize=1)
 def get_schema_context() -> str:
-    """Get schema context text for LLM"""
+    """
+    Get schema context text for LLM
+
+    Built once per process; the schema doesn't change at runtime.
+    """
     manager = get_schema_manager()
     return manager.generate_schema_context_text() + "\n\n" + manager.get_joins_text()
 
 
+@lru_cache(maxsize=64)
+def get_schema_context_for_tables(tables: frozenset) -> str:
+    """Get schema context text for LLM covering only the given tables"""
+    manager = get_schema_manager()
+    return manager.generate_schema_context_text(tables) + "\n\n" + manager.get_joins_text(tables)
+
+
 def get_table_list() -> List[str]:
     """Get list of all table names"""
     return get_schema_manager().get_table_list()
@@ -19,6 +19,16 @@ class Settings:
     # LLM
     LLAMA_SERVER_URL = os.getenv('LLAMA_SERVER_URL', 'http://localhost:11434')
     LLAMA_MODEL = os.getenv('LLAMA_MODEL', 'llama3.1')
+    LLAMA_MAX_CONCURRENCY = int(os.getenv('LLAMA_MAX_CONCURRENCY', '4'))
+    LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'ollama').lower()  # ollama | anthropic
+    ANTHROPIC_API_URL = os.getenv('ANTHROPIC_API_URL', 'https://api.anthropic.com')
+    ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', '')
+    ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-3-5-haiku-latest')
+    SCHEMA_TABLES_TOP_K = int(os.getenv('SCHEMA_TABLES_TOP_K', '0'))  # 0 sends the full schema
+
+    # Embeddings
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'onnx').lower()  # onnx | torch
+    EMBEDDING_NUM_THREADS = int(os.getenv('EMBEDDING_NUM_THREADS', '0'))  # 0 = all cores
     
     # Anomaly Detection
     ZSCORE_THRESHOLD = float(os.getenv('ZSCORE_THRESHOLD', '3.0'))
@@ -29,6 +39,7 @@ class Settings:
     # Performance
     QUERY_TIMEOUT = int(os.getenv('QUERY_TIMEOUT_SECONDS', '300'))
     MAX_RECORDS_PER_QUERY = int(os.getenv('MAX_RECORDS_PER_QUERY', '1000000'))
+    POOL_WAIT_TIMEOUT = float(os.getenv('POOL_WAIT_TIMEOUT_SECONDS', '5'))
     
     # API
     API_PORT = int(os.getenv('API_PORT', '8000'))
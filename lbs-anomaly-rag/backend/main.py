@@ -4,9 +4,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
+import threading
 from services.rag_service import RAGService
 from services.schema_context import get_example_queries
 from services.anomaly_detection import AnomalyDetector
+from services.db_pool import get_connection_pool, close_connection_pool
 
 app = FastAPI(
     title="Data Warehouse RAG API",
@@ -31,6 +33,30 @@ rag_service = RAGService()
 anomaly_detector = AnomalyDetector()
 
 
+@app.on_event("startup")
+async def warm_caches():
+    """Open the DB pool and warm the SQL result cache without blocking startup"""
+    threading.Thread(target=_warm_services, daemon=True).start()
+
+
+def _warm_services():
+    try:
+        get_connection_pool()
+    except Exception as e:
+        print(f"[WARN] Connection pool initialization failed: {e}")
+    rag_service.warm_cache()
+
+
+@app.on_event("shutdown")
+def close_resources():
+    """Flush pending cache/vector store writes and close pooled DB connections on graceful shutdown"""
+    if rag_service.cache:
+        rag_service.cache.flush()
+    if rag_service.vector_store:
+        rag_service.vector_store.flush()
+    close_connection_pool()
+
+
 # Request/Response Models
 class QueryRequest(BaseModel):
     question: str = Field(..., description="Natural language question about data")
@@ -38,6 +64,21 @@ class QueryRequest(BaseModel):
     limit: int = Field(100, description="Maximum number of rows to return", ge=1, le=10000)
 
 
+# Each question is a full LLM + DB pipeline; keep batches dashboard-sized
+MAX_BATCH_QUESTIONS = 20
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(
+        ...,
+        description=f"Natural language questions (at most {MAX_BATCH_QUESTIONS})",
+        min_length=1,
+        max_length=MAX_BATCH_QUESTIONS
+    )
+    execute: bool = Field(True, description="Whether to execute the generated SQL")
+    limit: int = Field(100, description="Maximum number of rows to return per question", ge=1, le=10000)
+
+
 class SQLValidateRequest(BaseModel):
     sql: str = Field(..., description="SQL query to validate")
 
@@ -74,6 +115,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "/query": "POST - Natural language query",
+            "/query/batch": "POST - Several natural language queries at once",
             "/examples": "GET - Example queries",
             "/validate": "POST - Validate SQL query",
             "/health": "GET - Health check"
@@ -114,6 +156,38 @@ async def query_data(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/batch", response_model=List[QueryResponse])
+def query_batch(request: BatchQueryRequest):
+    """
+    Answer several questions concurrently (e.g. a dashboard refresh)
+
+    Results are returned in the order of the questions; a failed question
+    has success=false and an error instead of failing the whole batch.
+    Batches are capped at MAX_BATCH_QUESTIONS questions. Declared as a plain
+    def so FastAPI runs the blocking batch in its threadpool instead of
+    holding the event loop.
+    """
+    try:
+        results = rag_service.batch_query(
+            questions=request.questions,
+            execute=request.execute,
+            limit=request.limit
+        )
+
+        for result in results:
+            if result.get("success") and result.get("data"):
+                result["chart_suggestion"] = rag_service.get_chart_suggestion(
+                    intent=result["intent"],
+                    columns=result["columns"],
+                    data=result["data"]
+                )
+
+        return [QueryResponse(**result) for result in results]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.post("/generate-sql")
 async def generate_sql_only(question: str = Query(..., description="Natural language question")):
     """
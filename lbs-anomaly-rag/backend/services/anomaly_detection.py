@@ -4,17 +4,88 @@ import pandas as pd
 import numpy as np
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timedelta
-from scipy import stats
-from sklearn.ensemble import IsolationForest
 from config.settings import settings
 
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def _zscore_flag_numpy(values: np.ndarray, threshold: float):
+    """Z-score each value (sample std, like pandas) and flag |z| > threshold"""
+    n = values.shape[0]
+    if n < 2:
+        return np.zeros(n), np.zeros(n, dtype=np.bool_)
+    std = values.std(ddof=1)
+    if std == 0:
+        return np.zeros(n), np.zeros(n, dtype=np.bool_)
+    z = (values - values.mean()) / std
+    return z, np.abs(z) > threshold
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _zscore_flag(values, threshold):
+        """Compiled z-score kernel - same results as _zscore_flag_numpy"""
+        n = values.shape[0]
+        z = np.zeros(n)
+        flags = np.zeros(n, dtype=np.bool_)
+        if n < 2:
+            return z, flags
+
+        mean = 0.0
+        for i in range(n):
+            mean += values[i]
+        mean /= n
+
+        sq = 0.0
+        for i in range(n):
+            sq += (values[i] - mean) ** 2
+        std = np.sqrt(sq / (n - 1))
+        if std == 0.0:
+            return z, flags
+
+        for i in prange(n):
+            z[i] = (values[i] - mean) / std
+            flags[i] = abs(z[i]) > threshold
+        return z, flags
+else:
+    _zscore_flag = _zscore_flag_numpy
+
+
+def _to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Convert a DataFrame to JSON-safe records
+
+    Datetime columns become ISO strings and NaN/NaT become None with
+    column-level operations instead of a per-cell Python loop.
+    """
+    out = df.copy()
+    for col in out.select_dtypes(include=["datetime", "datetimetz"]).columns:
+        out[col] = out[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    out = out.astype(object).where(out.notna(), None)
+    return out.to_dict('records')
+
 
 class AnomalyDetector:
     """Detect anomalies in data warehouse using multiple methods"""
 
-    def __init__(self):
+    def __init__(self, use_cache: bool = True):
         self.zscore_threshold = 3.0
         self.iqr_multiplier = 1.5
+        self.use_cache = use_cache
+
+        # Initialize cache if enabled
+        self.cache = None
+        if self.use_cache:
+            try:
+                from services.cache_service import get_cache_service
+                self.cache = get_cache_service()
+            except Exception as e:
+                print(f"[WARN] Cache initialization failed: {e}")
+                self.use_cache = False
 
     def _get_db_connection(self):
         """Get database connection"""
@@ -25,7 +96,8 @@ class AnomalyDetector:
         self,
         metric: str = "SalesAmount",
         granularity: str = "daily",
-        lookback_days: int = 90
+        lookback_days: int = 90,
+        data: Optional[pd.DataFrame] = None
     ) -> Dict[str, Any]:
         """
         Detect time series anomalies in data
@@ -34,10 +106,15 @@ class AnomalyDetector:
             metric: Metric to analyze (SalesAmount, OrderQuantity, etc.)
             granularity: Time granularity (daily, weekly, monthly)
             lookback_days: Number of days to analyze
+            data: Preloaded series (TimePeriod, MetricValue, OrderCount).
+                  When given, the database query is skipped.
 
         Returns:
             Dictionary with anomalies and analysis
         """
+        if data is not None:
+            return self._analyze_time_series(data.copy(), granularity, lookback_days)
+
         conn = self._get_db_connection()
 
         # Build time series query based on granularity
@@ -69,6 +146,42 @@ class AnomalyDetector:
         df = pd.read_sql(query, conn)
         conn.close()
 
+        return self._analyze_time_series(df, granularity, lookback_days)
+
+    def _load_daily_series(self, metric: str = "SalesAmount", lookback_days: int = 365) -> pd.DataFrame:
+        """Load the daily metric series once so it can be sliced and resampled"""
+        conn = self._get_db_connection()
+
+        query = f"""
+        SELECT
+            dt.FullDateAlternateKey AS TimePeriod,
+            SUM(sal.{metric}) AS MetricValue,
+            COUNT(DISTINCT sal.SalesOrderNumber) AS OrderCount
+        FROM dbo.FactInternetSales sal
+        INNER JOIN dbo.DimDate dt ON dt.DateKey = sal.OrderDateKey
+        WHERE dt.FullDateAlternateKey >= DATEADD(DAY, -{lookback_days}, GETDATE())
+        GROUP BY dt.FullDateAlternateKey
+        ORDER BY dt.FullDateAlternateKey
+        """
+
+        df = pd.read_sql(query, conn)
+        conn.close()
+        return df
+
+    @staticmethod
+    def _resample_monthly(daily_df: pd.DataFrame) -> pd.DataFrame:
+        """Roll a daily series up to calendar months (orders are counted on a single day, so sums are exact)"""
+        if daily_df.empty:
+            return daily_df.copy()
+
+        monthly = daily_df.assign(TimePeriod=pd.to_datetime(daily_df['TimePeriod']))
+        monthly = monthly.set_index('TimePeriod')[['MetricValue', 'OrderCount']].resample('MS').sum()
+        monthly = monthly.reset_index()
+        monthly['TimePeriod'] = monthly['TimePeriod'].dt.date
+        return monthly
+
+    def _analyze_time_series(self, df: pd.DataFrame, granularity: str, lookback_days: int) -> Dict[str, Any]:
+        """Flag spikes and drops in a (TimePeriod, MetricValue, OrderCount) series"""
         if df.empty:
             return {"anomalies": [], "statistics": {}, "method": "time_series"}
 
@@ -128,7 +241,7 @@ class AnomalyDetector:
             "anomalies": anomalies,
             "statistics": statistics,
             "method": "time_series",
-            "time_series_data": df.to_dict('records')
+            "time_series_data": _to_records(df)
         }
 
     def detect_statistical_anomalies(
@@ -171,7 +284,8 @@ class AnomalyDetector:
             COUNT(DISTINCT sal.SalesOrderNumber) AS OrderCount,
             AVG(sal.{metric}) AS AvgValue,
             MIN(sal.{metric}) AS MinValue,
-            MAX(sal.{metric}) AS MaxValue
+            MAX(sal.{metric}) AS MaxValue,
+            MAX(sal.OrderDateKey) AS LastOrderDateKey
         FROM dbo.FactInternetSales sal
         INNER JOIN dbo.{dim_table} {alias} ON {alias}.{dimension} = sal.{dimension}
         GROUP BY sal.{dimension}, {alias}.{display_col}
@@ -189,9 +303,12 @@ class AnomalyDetector:
         if method == "zscore":
             # Z-score method
             mean = df['MetricValue'].mean()
-            std = df['MetricValue'].std()
-            df['ZScore'] = (df['MetricValue'] - mean) / std
-            df['IsAnomaly'] = abs(df['ZScore']) > self.zscore_threshold
+            zscores, flags = _zscore_flag(
+                df['MetricValue'].to_numpy(dtype=np.float64),
+                float(self.zscore_threshold)
+            )
+            df['ZScore'] = zscores
+            df['IsAnomaly'] = flags
 
             for _, row in df[df['IsAnomaly']].iterrows():
                 anomalies.append({
@@ -232,8 +349,29 @@ class AnomalyDetector:
         elif method == "isolation_forest":
             # Isolation Forest
             if len(df) >= 10:
-                iso_forest = IsolationForest(contamination=0.1, random_state=42)
-                df['Anomaly'] = iso_forest.fit_predict(df[['MetricValue']].values)
+                values = df[['MetricValue']].values
+
+                # Reuse the fitted forest while the underlying data is unchanged
+                fingerprint = {
+                    "dimension": dimension,
+                    "metric": metric,
+                    "rows": len(df),
+                    "last_date": int(df['LastOrderDateKey'].max()),
+                    "total": round(float(df['MetricValue'].sum()), 2)
+                }
+                iso_forest = None
+                if self.use_cache and self.cache:
+                    iso_forest = self.cache.get_model_cache("isolation_forest", fingerprint)
+
+                if iso_forest is None:
+                    # Deferred: scikit-learn is only needed for this method and is slow to import
+                    from sklearn.ensemble import IsolationForest
+                    iso_forest = IsolationForest(contamination=0.1, random_state=42)
+                    iso_forest.fit(values)
+                    if self.use_cache and self.cache:
+                        self.cache.set_model_cache("isolation_forest", fingerprint, iso_forest)
+
+                df['Anomaly'] = iso_forest.predict(values)
                 df['IsAnomaly'] = df['Anomaly'] == -1
 
                 median = df['MetricValue'].median()
@@ -418,7 +556,7 @@ class AnomalyDetector:
             "anomalies": anomalies,
             "statistics": statistics,
             "method": "comparative",
-            "comparison_data": df.to_dict('records')
+            "comparison_data": _to_records(df)
         }
 
     def detect_day_on_day_anomalies(
@@ -626,7 +764,7 @@ class AnomalyDetector:
             "anomalies": anomalies,
             "statistics": statistics,
             "method": "day_on_day",
-            "all_data": df.to_dict('records')
+            "all_data": _to_records(df)
         }
 
     def detect_prophet_anomalies(
@@ -822,39 +960,63 @@ class AnomalyDetector:
             "anomaly_types": {}
         }
 
-        try:
-            # Time series anomalies
-            results["anomaly_types"]["time_series_daily"] = self.detect_time_series_anomalies(
-                granularity="daily",
-                lookback_days=30
-            )
-
-            results["anomaly_types"]["time_series_monthly"] = self.detect_time_series_anomalies(
-                granularity="monthly",
-                lookback_days=365
-            )
-
-            # Statistical anomalies
-            results["anomaly_types"]["statistical_products"] = self.detect_statistical_anomalies(
-                dimension="ProductKey",
-                method="zscore"
-            )
+        # Detection name -> (cache type, parameters)
+        detections = {
+            "time_series_daily": ("time_series", {"granularity": "daily", "lookback_days": 30}),
+            "time_series_monthly": ("time_series", {"granularity": "monthly", "lookback_days": 365}),
+            "statistical_products": ("statistical", {"dimension": "ProductKey", "method": "zscore"}),
+            "statistical_customers": ("statistical", {"dimension": "CustomerKey", "method": "isolation_forest"}),
+            "comparative_yoy": ("comparative", {"comparison_type": "yoy", "threshold_pct": 15.0}),
+            "comparative_mom": ("comparative", {"comparison_type": "mom", "threshold_pct": 20.0}),
+        }
 
-            results["anomaly_types"]["statistical_customers"] = self.detect_statistical_anomalies(
-                dimension="CustomerKey",
-                method="isolation_forest"
-            )
+        try:
+            # Fetch every cached result in a single round-trip
+            cached = {}
+            if self.use_cache and self.cache:
+                cached = self.cache.get_anomaly_cache_many(detections)
+
+            computed = {}
+            missing = [name for name in detections if not cached.get(name)]
+
+            # Time series anomalies - load the yearly daily series once and derive
+            # both granularities from it instead of querying twice
+            if "time_series_daily" in missing or "time_series_monthly" in missing:
+                daily_df = self._load_daily_series(lookback_days=365)
+
+                if "time_series_daily" in missing:
+                    cutoff = pd.Timestamp.now() - pd.Timedelta(days=30)
+                    recent_df = daily_df[pd.to_datetime(daily_df['TimePeriod']) >= cutoff]
+                    computed["time_series_daily"] = self.detect_time_series_anomalies(
+                        granularity="daily",
+                        lookback_days=30,
+                        data=recent_df
+                    )
 
-            # Comparative anomalies
-            results["anomaly_types"]["comparative_yoy"] = self.detect_comparative_anomalies(
-                comparison_type="yoy",
-                threshold_pct=15.0
-            )
+                if "time_series_monthly" in missing:
+                    computed["time_series_monthly"] = self.detect_time_series_anomalies(
+                        granularity="monthly",
+                        lookback_days=365,
+                        data=self._resample_monthly(daily_df)
+                    )
 
-            results["anomaly_types"]["comparative_mom"] = self.detect_comparative_anomalies(
-                comparison_type="mom",
-                threshold_pct=20.0
-            )
+            # Statistical and comparative anomalies
+            for name in missing:
+                detection_type, params = detections[name]
+                if detection_type == "statistical":
+                    computed[name] = self.detect_statistical_anomalies(**params)
+                elif detection_type == "comparative":
+                    computed[name] = self.detect_comparative_anomalies(**params)
+
+            # Store everything that was computed in a single round-trip
+            if computed and self.use_cache and self.cache:
+                self.cache.set_anomaly_cache_many(detections, computed, ttl=3600)
+
+            for name in detections:
+                if name in computed:
+                    results["anomaly_types"][name] = computed[name]
+                else:
+                    results["anomaly_types"][name] = cached[name]
 
             # Summary
             total_anomalies = sum(
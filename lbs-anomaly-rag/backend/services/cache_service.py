@@ -1,11 +1,118 @@
 """Cache Service for Query Results and Anomaly Detection"""
 import json
 import hashlib
-from typing import Any, Optional, Dict
-from datetime import datetime, timedelta
+import hmac
+import re
+import fnmatch
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any, Optional, Dict, List, Tuple
+import time
 import os
+import pickle
+import secrets
+import atexit
 import threading
 
+try:
+    import msgpack
+    import xxhash
+    FAST_HASH_AVAILABLE = True
+except ImportError:
+    FAST_HASH_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _dumps(value: Any) -> bytes:
+    """Serialize a cache value to JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data: bytes) -> Any:
+    """Deserialize JSON bytes (or str) produced by _dumps"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+try:
+    import sqlparse
+    from sqlparse import tokens as sql_tokens
+    SQLPARSE_AVAILABLE = True
+except ImportError:
+    SQLPARSE_AVAILABLE = False
+
+
+@lru_cache(maxsize=1024)
+def _normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a SQL statement for cache keys
+
+    Whitespace and comments are dropped and keywords upper-cased, so queries that
+    differ only in formatting share an entry. Literals and identifiers keep their case.
+    A trailing semicolon is ignored.
+    """
+    if not SQLPARSE_AVAILABLE:
+        return " ".join(sql.split()).rstrip("; ")
+
+    return " ".join(
+        token.value.upper() if token.is_keyword else token.value
+        for statement in sqlparse.parse(sql)
+        for token in statement.flatten()
+        if not token.is_whitespace and token.ttype not in sql_tokens.Comment
+    ).rstrip("; ")
+
+
+# One-byte tags prefixed to Redis payloads so already-serialized values skip JSON
+_TAG_JSON = b'J'
+_TAG_STR = b'S'
+_TAG_BYTES = b'R'
+
+
+def _encode_value(value: Any) -> bytes:
+    """Encode a value for Redis, passing str/bytes through without JSON"""
+    if isinstance(value, (bytes, bytearray)):
+        return _TAG_BYTES + bytes(value)
+    if isinstance(value, str):
+        return _TAG_STR + value.encode('utf-8')
+    return _TAG_JSON + _dumps(value)
+
+
+def _decode_value(data: bytes) -> Any:
+    """Decode a payload written by _encode_value"""
+    tag, payload = data[:1], data[1:]
+    if tag == _TAG_JSON:
+        return _loads(payload)
+    if tag == _TAG_STR:
+        return payload.decode('utf-8')
+    if tag == _TAG_BYTES:
+        return payload
+    # Untagged JSON written before tagging was introduced
+    return _loads(data)
+
+
+def _canonicalize(data: Any) -> Any:
+    """
+    Convert to nested tuples with sorted dict items, so equal payloads are hashable and pack identically
+
+    Numbers are tagged with their type: True == 1 == 1.0 hash alike, which
+    would otherwise let different payloads share a memoized key.
+    """
+    if isinstance(data, dict):
+        return tuple((_canonicalize(k), _canonicalize(v)) for k, v in sorted(data.items()))
+    if isinstance(data, (list, tuple)):
+        return tuple(_canonicalize(v) for v in data)
+    if isinstance(data, (bool, int, float)):
+        return (type(data).__name__, data)
+    return data
+
 
 class CacheService:
     """
@@ -17,8 +124,24 @@ class CacheService:
     - Cache invalidation support
     - Hit/miss statistics
     - Disk persistence for in-memory cache (survives restarts)
+    - LRU eviction for the in-memory cache
     """
 
+    # Maximum number of entries kept by the in-memory cache
+    MAX_MEMORY_ENTRIES = 1000
+
+    # Seconds to wait after a write before persisting, so bursts coalesce
+    PERSIST_DEBOUNCE_SECONDS = 1.0
+
+    # Compact the append-only log once it holds this many records per live entry
+    AOF_COMPACTION_RATIO = 2
+
+    # Seconds between background sweeps of expired in-memory entries
+    JANITOR_INTERVAL_SECONDS = 30
+
+    # Number of lock stripes guarding in-memory entries (power of two)
+    LOCK_STRIPES = 16
+
     def __init__(self, redis_url: str = None):
         """
         Initialize cache service
@@ -28,13 +151,24 @@ class CacheService:
         """
         self.redis_client = None
         self.use_redis = False
-        self.memory_cache: Dict[str, tuple] = {}  # key -> (value, expiry_iso)
+        self.memory_cache: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expiry_monotonic), LRU order
         self.stats = {"hits": 0, "misses": 0, "sets": 0}
+        self._stats_lock = threading.Lock()
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
         self._save_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._pending_ops: deque = deque()  # (op, key, value, expiry_monotonic) not yet in the log
+        self._aof_records = 0
 
-        # Disk persistence path
+        # Disk persistence: snapshot + append-only log of changes since the snapshot
         base_dir = os.path.dirname(os.path.dirname(__file__))
         self._persist_path = os.path.join(base_dir, "chroma_db", "cache.json")
+        self._aof_path = os.path.join(base_dir, "chroma_db", "cache.aof")
+
+        # Pickled models are HMAC-signed so a writable Redis can't inject code;
+        # without a shared key they only verify within this process
+        signing_key = os.getenv('CACHE_SIGNING_KEY', '')
+        self._signing_key = signing_key.encode('utf-8') if signing_key else secrets.token_bytes(32)
 
         # Try to connect to Redis
         if redis_url is None:
@@ -44,7 +178,7 @@ class CacheService:
             import redis
             self.redis_client = redis.from_url(
                 redis_url,
-                decode_responses=True,
+                decode_responses=False,
                 socket_connect_timeout=2
             )
             # Test connection
@@ -57,13 +191,55 @@ class CacheService:
             count = len(self.memory_cache)
             print(f"  Using in-memory cache ({count} entries loaded from disk)")
 
+            # Persist from a background thread so writes never block requests
+            threading.Thread(
+                target=self._persistence_worker,
+                name="cache-persistence",
+                daemon=True
+            ).start()
+            threading.Thread(
+                target=self._janitor_worker,
+                name="cache-janitor",
+                daemon=True
+            ).start()
+            atexit.register(self.flush)
+
     def _generate_key(self, prefix: str, data: Any) -> str:
         """Generate cache key from data"""
-        # Create hash of the data
-        data_str = json.dumps(data, sort_keys=True)
+        canonical = _canonicalize(data)
+        try:
+            return self._generate_key_cached(prefix, canonical)
+        except TypeError:
+            # Unhashable leaf value - hash without memoizing
+            return self._hash_key(prefix, canonical)
+
+    @staticmethod
+    @lru_cache(maxsize=4096, typed=True)
+    def _generate_key_cached(prefix: str, canonical: tuple) -> str:
+        """Memoized _hash_key for repeated identical inputs"""
+        return CacheService._hash_key(prefix, canonical)
+
+    @staticmethod
+    def _hash_key(prefix: str, canonical: Any) -> str:
+        """Hash canonicalized data into a cache key"""
+        if FAST_HASH_AVAILABLE:
+            packed = msgpack.packb(canonical, use_bin_type=True)
+            return f"{prefix}:{xxhash.xxh3_64_hexdigest(packed)}"
+
+        # Fallback: MD5 of the JSON encoding
+        data_str = json.dumps(canonical)
         hash_obj = hashlib.md5(data_str.encode())
         return f"{prefix}:{hash_obj.hexdigest()}"
 
+    def _lock_for(self, key: str) -> threading.Lock:
+        """Lock stripe guarding a key's read-modify-write sequences"""
+        return self._locks[hash(key) & (self.LOCK_STRIPES - 1)]
+
+    def _count(self, stat: str, n: int = 1):
+        """Increment a statistics counter"""
+        with self._stats_lock:
+            self.stats[stat] += n
+
     def get(self, key: str) -> Optional[Any]:
         """
         Get value from cache
@@ -79,28 +255,34 @@ class CacheService:
                 # Get from Redis
                 value = self.redis_client.get(key)
                 if value:
-                    self.stats["hits"] += 1
-                    return json.loads(value)
+                    self._count("hits")
+                    return _decode_value(value)
                 else:
-                    self.stats["misses"] += 1
+                    self._count("misses")
                     return None
             else:
                 # Get from memory cache
-                if key in self.memory_cache:
-                    value, expiry_iso = self.memory_cache[key]
-                    if expiry_iso is None or datetime.now() < datetime.fromisoformat(expiry_iso):
-                        self.stats["hits"] += 1
-                        return value
-                    else:
-                        # Expired
-                        del self.memory_cache[key]
-
-                self.stats["misses"] += 1
+                with self._lock_for(key):
+                    entry = self.memory_cache.get(key)
+                    if entry is not None:
+                        value, expiry_ts = entry
+                        if expiry_ts is None or time.monotonic() < expiry_ts:
+                            try:
+                                self.memory_cache.move_to_end(key)
+                            except KeyError:
+                                pass  # Evicted by a concurrent set
+                            self._count("hits")
+                            return value
+                        else:
+                            # Expired
+                            self.memory_cache.pop(key, None)
+
+                self._count("misses")
                 return None
 
         except Exception as e:
             print(f"Cache get error: {e}")
-            self.stats["misses"] += 1
+            self._count("misses")
             return None
 
     def set(self, key: str, value: Any, ttl_seconds: int = 300) -> bool:
@@ -109,35 +291,39 @@ class CacheService:
 
         Args:
             key: Cache key
-            value: Value to cache (must be JSON serializable)
+            value: Value to cache (JSON serializable, or str/bytes stored as-is)
             ttl_seconds: Time to live in seconds (default: 5 minutes)
 
         Returns:
             True if successful
         """
         try:
-            self.stats["sets"] += 1
+            self._count("sets")
 
             if self.use_redis:
                 # Set in Redis with TTL
                 self.redis_client.setex(
                     key,
                     ttl_seconds,
-                    json.dumps(value)
+                    _encode_value(value)
                 )
                 return True
             else:
-                # Set in memory cache (store expiry as ISO string for disk persistence)
-                expiry_iso = (datetime.now() + timedelta(seconds=ttl_seconds)).isoformat() if ttl_seconds else None
-                self.memory_cache[key] = (value, expiry_iso)
-
-                # Clean up expired entries if cache is getting large
-                if len(self.memory_cache) > 1000:
-                    self._cleanup_memory_cache()
-
-                # Persist to disk every 10 writes
-                if self.stats["sets"] % 10 == 0:
-                    self._save_to_disk()
+                # Set in memory cache (expiry as a monotonic-clock deadline)
+                expiry_ts = time.monotonic() + ttl_seconds if ttl_seconds else None
+                with self._lock_for(key):
+                    self.memory_cache[key] = (value, expiry_ts)
+                    self.memory_cache.move_to_end(key)
+
+                    # Schedule a background append to the log
+                    self._log("set", key, value, expiry_ts)
+
+                # Evict least recently used entries once over capacity
+                while len(self.memory_cache) > self.MAX_MEMORY_ENTRIES:
+                    try:
+                        self.memory_cache.popitem(last=False)
+                    except KeyError:
+                        break
 
                 return True
 
@@ -145,15 +331,73 @@ class CacheService:
             print(f"Cache set error: {e}")
             return False
 
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[Any]]:
+        """
+        Get several values in one round-trip
+
+        Args:
+            keys: Cache keys
+
+        Returns:
+            Dictionary of key -> cached value (None if not found/expired)
+        """
+        if not self.use_redis:
+            return {key: self.get(key) for key in keys}
+
+        try:
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.get(key)
+                values = pipe.execute()
+        except Exception as e:
+            print(f"Cache get_many error: {e}")
+            self._count("misses", len(keys))
+            return {key: None for key in keys}
+
+        results = {}
+        for key, value in zip(keys, values):
+            if value:
+                self._count("hits")
+                results[key] = _decode_value(value)
+            else:
+                self._count("misses")
+                results[key] = None
+        return results
+
+    def set_many(self, items: Dict[str, Tuple[Any, int]]) -> bool:
+        """
+        Set several values in one round-trip
+
+        Args:
+            items: Dictionary of key -> (value, ttl_seconds)
+
+        Returns:
+            True if successful
+        """
+        if not self.use_redis:
+            return all([self.set(key, value, ttl) for key, (value, ttl) in items.items()])
+
+        try:
+            self._count("sets", len(items))
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for key, (value, ttl) in items.items():
+                    pipe.setex(key, ttl, _encode_value(value))
+                pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Cache set_many error: {e}")
+            return False
+
     def delete(self, key: str) -> bool:
         """Delete key from cache"""
         try:
             if self.use_redis:
                 return bool(self.redis_client.delete(key))
             else:
-                if key in self.memory_cache:
-                    del self.memory_cache[key]
-                    return True
+                with self._lock_for(key):
+                    if self.memory_cache.pop(key, None) is not None:
+                        self._log("del", key)
+                        return True
                 return False
         except Exception:
             return False
@@ -179,71 +423,198 @@ class CacheService:
                     return self.redis_client.flushdb()
             else:
                 if pattern:
-                    # Simple pattern matching for memory cache
-                    prefix = pattern.replace('*', '')
-                    keys_to_delete = [k for k in self.memory_cache.keys() if k.startswith(prefix)]
+                    # Glob matching (same syntax as Redis KEYS) for memory cache
+                    regex = re.compile(fnmatch.translate(pattern))
+                    keys_to_delete = [k for k in list(self.memory_cache) if regex.match(k)]
                     for k in keys_to_delete:
-                        del self.memory_cache[k]
+                        with self._lock_for(k):
+                            self.memory_cache.pop(k, None)
+                            self._log("del", k)
                     return len(keys_to_delete)
                 else:
                     count = len(self.memory_cache)
                     self.memory_cache.clear()
+                    self._log("clear")
                     return count
         except Exception as e:
             print(f"Cache clear error: {e}")
             return 0
 
+    def _janitor_worker(self):
+        """Periodically drop expired entries so get/set never have to scan"""
+        while True:
+            time.sleep(self.JANITOR_INTERVAL_SECONDS)
+            try:
+                self._cleanup_memory_cache()
+            except Exception as e:
+                print(f"[WARN] Cache cleanup failed: {e}")
+
     def _cleanup_memory_cache(self):
         """Remove expired entries from memory cache"""
-        now = datetime.now()
+        now = time.monotonic()
         expired_keys = [
-            k for k, (_, expiry_iso) in self.memory_cache.items()
-            if expiry_iso and datetime.fromisoformat(expiry_iso) <= now
+            k for k, (_, expiry_ts) in list(self.memory_cache.items())
+            if expiry_ts is not None and expiry_ts <= now
         ]
         for k in expired_keys:
-            del self.memory_cache[k]
+            with self._lock_for(k):
+                entry = self.memory_cache.get(k)
+                # Re-check under the stripe lock; the key may have been refreshed
+                if entry is not None and entry[1] is not None and entry[1] <= now:
+                    self.memory_cache.pop(k, None)
+
+    @staticmethod
+    def _to_wall_time(expiry_ts: Optional[float]) -> Optional[float]:
+        """Convert a monotonic deadline to a Unix timestamp for persistence"""
+        if expiry_ts is None:
+            return None
+        return time.time() + (expiry_ts - time.monotonic())
+
+    @staticmethod
+    def _from_wall_time(expiry: Optional[float]) -> Optional[float]:
+        """Convert a persisted Unix timestamp back to a monotonic deadline"""
+        if expiry is None:
+            return None
+        return time.monotonic() + (expiry - time.time())
 
     def _load_from_disk(self):
-        """Load in-memory cache from disk"""
-        if not os.path.exists(self._persist_path):
+        """Load the snapshot, then replay the append-only log on top of it"""
+        if os.path.exists(self._persist_path):
+            try:
+                with open(self._persist_path, 'rb') as f:
+                    data = _loads(f.read())
+                now = time.time()
+                for key, entry in data.items():
+                    expiry = entry.get("expiry")
+                    if expiry is not None and (not isinstance(expiry, (int, float)) or expiry <= now):
+                        continue  # Skip expired (and entries from the old ISO-string format)
+                    self.memory_cache[key] = (entry["value"], self._from_wall_time(expiry))
+            except Exception as e:
+                print(f"[WARN] Could not load cache from disk: {e}")
+
+        self._replay_log()
+
+        while len(self.memory_cache) > self.MAX_MEMORY_ENTRIES:
+            self.memory_cache.popitem(last=False)
+
+    def _replay_log(self):
+        """Apply the records of the append-only log to memory_cache"""
+        if not os.path.exists(self._aof_path):
             return
         try:
-            with open(self._persist_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            now = datetime.now()
-            for key, entry in data.items():
-                expiry_iso = entry.get("expiry")
-                if expiry_iso and datetime.fromisoformat(expiry_iso) <= now:
-                    continue  # Skip expired
-                self.memory_cache[key] = (entry["value"], expiry_iso)
+            now = time.time()
+            with open(self._aof_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = _loads(line)
+                    except Exception:
+                        continue  # Torn write at the tail of the log
+                    self._aof_records += 1
+
+                    op = record.get("op")
+                    key = record.get("k")
+                    if op == "set":
+                        expiry = record.get("e")
+                        if expiry is not None and expiry <= now:
+                            self.memory_cache.pop(key, None)
+                        else:
+                            self.memory_cache[key] = (record.get("v"), self._from_wall_time(expiry))
+                            self.memory_cache.move_to_end(key)
+                    elif op == "del":
+                        self.memory_cache.pop(key, None)
+                    elif op == "clear":
+                        self.memory_cache.clear()
         except Exception as e:
-            print(f"[WARN] Could not load cache from disk: {e}")
+            print(f"[WARN] Could not replay cache log: {e}")
+
+    def _log(self, op: str, key: str = None, value: Any = None, expiry_ts: Optional[float] = None):
+        """Queue a change for the append-only log (written by the background thread)"""
+        if self.use_redis:
+            return
+        self._pending_ops.append((op, key, value, expiry_ts))
+        self._dirty.set()
+
+    def _persistence_worker(self):
+        """Append queued changes whenever the cache is marked dirty, coalescing bursts of writes"""
+        while True:
+            self._dirty.wait()
+            time.sleep(self.PERSIST_DEBOUNCE_SECONDS)
+            self._dirty.clear()
+            self._flush_log()
+
+    def flush(self):
+        """Write out changes still waiting in the debounce window (no-op with Redis)"""
+        self._dirty.clear()
+        self._flush_log()
+
+    def _flush_log(self):
+        """Append queued records to the log, compacting it once it outgrows the live set"""
+        with self._save_lock:
+            pending = []
+            while self._pending_ops:
+                pending.append(self._pending_ops.popleft())
+            if not pending:
+                return
+            try:
+                os.makedirs(os.path.dirname(self._aof_path), exist_ok=True)
+                with open(self._aof_path, 'ab') as f:
+                    for op, key, value, expiry_ts in pending:
+                        record = {"op": op}
+                        if key is not None:
+                            record["k"] = key
+                        if op == "set":
+                            record["v"] = value
+                            record["e"] = self._to_wall_time(expiry_ts)
+                        try:
+                            line = _dumps(record) + b"\n"
+                        except TypeError:
+                            continue  # Not JSON serializable - kept in memory only
+                        f.write(line)
+                        self._aof_records += 1
+            except Exception as e:
+                print(f"[WARN] Could not append to cache log: {e}")
+                return
+
+        if self._aof_records > self.AOF_COMPACTION_RATIO * max(len(self.memory_cache), 100):
+            self._save_to_disk()
 
     def _save_to_disk(self):
-        """Persist in-memory cache to disk (debounced, non-blocking)"""
+        """Compact: write a fresh snapshot (atomic replace) and truncate the log"""
         if self.use_redis:
             return
         with self._save_lock:
             try:
                 os.makedirs(os.path.dirname(self._persist_path), exist_ok=True)
-                data = {}
-                for key, (value, expiry_iso) in self.memory_cache.items():
-                    data[key] = {"value": value, "expiry": expiry_iso}
-                with open(self._persist_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False)
+                entries = []
+                for key, (value, expiry_ts) in list(self.memory_cache.items()):
+                    if isinstance(value, (bytes, bytearray)):
+                        continue  # Binary values (e.g. pickled models) stay in memory only
+                    try:
+                        entry = _dumps({"value": value, "expiry": self._to_wall_time(expiry_ts)})
+                    except TypeError:
+                        continue  # Not JSON serializable - kept in memory only
+                    entries.append(_dumps(key) + b":" + entry)
+                tmp_path = self._persist_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(b"{" + b",".join(entries) + b"}")
+                os.replace(tmp_path, self._persist_path)
+                open(self._aof_path, 'wb').close()
+                self._aof_records = 0
             except Exception as e:
                 print(f"[WARN] Could not save cache to disk: {e}")
 
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
-        total_requests = self.stats["hits"] + self.stats["misses"]
-        hit_rate = (self.stats["hits"] / total_requests * 100) if total_requests > 0 else 0
+        with self._stats_lock:
+            counters = dict(self.stats)
+        total_requests = counters["hits"] + counters["misses"]
+        hit_rate = (counters["hits"] / total_requests * 100) if total_requests > 0 else 0
 
         stats = {
             "backend": "redis" if self.use_redis else "memory",
-            "hits": self.stats["hits"],
-            "misses": self.stats["misses"],
-            "sets": self.stats["sets"],
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "sets": counters["sets"],
             "hit_rate_pct": round(hit_rate, 2)
         }
 
@@ -281,36 +652,110 @@ class CacheService:
         key = self._generate_key(f"anomaly:{detection_type}", params)
         return self.set(key, result, ttl)
 
+    def get_anomaly_cache_many(self, detections: Dict[str, Tuple[str, Dict]]) -> Dict[str, Optional[Dict]]:
+        """Get several cached anomaly results (name -> (detection_type, params)) in one round-trip"""
+        keys = {
+            name: self._generate_key(f"anomaly:{detection_type}", params)
+            for name, (detection_type, params) in detections.items()
+        }
+        values = self.get_many(list(keys.values()))
+        return {name: values[key] for name, key in keys.items()}
+
+    def set_anomaly_cache_many(
+        self,
+        detections: Dict[str, Tuple[str, Dict]],
+        results: Dict[str, Dict],
+        ttl: int = 3600
+    ) -> bool:
+        """Cache several anomaly results (name -> (detection_type, params)) in one round-trip"""
+        items = {
+            self._generate_key(f"anomaly:{detection_type}", params): (results[name], ttl)
+            for name, (detection_type, params) in detections.items()
+            if name in results
+        }
+        return self.set_many(items) if items else True
+
+    def get_model_cache(self, model_type: str, params: Dict) -> Optional[Any]:
+        """Get a cached fitted model (e.g. an IsolationForest) keyed by its training-data fingerprint"""
+        key = self._generate_key(f"model:{model_type}", params)
+        data = self.get(key)
+        if not isinstance(data, (bytes, bytearray)):
+            return None
+        signature, payload = bytes(data[:32]), bytes(data[32:])
+        expected = hmac.new(self._signing_key, payload, hashlib.sha256).digest()
+        if not hmac.compare_digest(signature, expected):
+            print("[WARN] Ignoring cached model with an invalid signature")
+            return None
+        try:
+            return pickle.loads(payload)
+        except Exception as e:
+            print(f"[WARN] Could not load cached model: {e}")
+            return None
+
+    def set_model_cache(self, model_type: str, params: Dict, model: Any, ttl: int = 86400) -> bool:
+        """Cache a fitted model (default: 24 hours)"""
+        key = self._generate_key(f"model:{model_type}", params)
+        payload = pickle.dumps(model)
+        signature = hmac.new(self._signing_key, payload, hashlib.sha256).digest()
+        return self.set(key, signature + payload, ttl)
+
     def get_sql_cache(self, sql: str) -> Optional[Dict]:
         """Get cached SQL execution result (keyed by SQL hash, not question)"""
-        key = self._generate_key("sql", {"sql": sql.strip().upper()})
+        key = self._generate_key("sql", {"sql": _normalize_sql(sql)})
         return self.get(key)
 
     def set_sql_cache(self, sql: str, result: Dict, ttl: int = 3600) -> bool:
         """Cache SQL result (default: 1 hour - data is static)"""
-        key = self._generate_key("sql", {"sql": sql.strip().upper()})
+        key = self._generate_key("sql", {"sql": _normalize_sql(sql)})
+        return self.set(key, result, ttl)
+
+    def get_sql_error_cache(self, sql: str) -> Optional[Dict]:
+        """Get cached SQL execution failure"""
+        key = self._generate_key("sql_err", {"sql": _normalize_sql(sql)})
+        return self.get(key)
+
+    def set_sql_error_cache(self, sql: str, result: Dict, ttl: int = 60) -> bool:
+        """Cache SQL failure (default: 1 minute - the query may be fixed upstream)"""
+        key = self._generate_key("sql_err", {"sql": _normalize_sql(sql)})
         return self.set(key, result, ttl)
 
+    def get_generated_sql_cache(self, schema_hash: str, question: str) -> Optional[Dict]:
+        """Get cached LLM-generated SQL for a normalized question under a given schema"""
+        key = self._generate_key("gen_sql", {"schema": schema_hash, "q": question})
+        return self.get(key)
+
+    def set_generated_sql_cache(self, schema_hash: str, question: str, result: Dict, ttl: int = 604800) -> bool:
+        """Cache LLM-generated SQL (default: 7 days - a schema change yields a new key)"""
+        key = self._generate_key("gen_sql", {"schema": schema_hash, "q": question})
+        return self.set(key, result, ttl)
+
+    def delete_generated_sql_cache(self, schema_hash: str, question: str) -> bool:
+        """Drop cached LLM-generated SQL, e.g. after it failed to execute"""
+        key = self._generate_key("gen_sql", {"schema": schema_hash, "q": question})
+        return self.delete(key)
+
     def clear_query_cache(self) -> int:
         """Clear all query caches"""
-        count = self.clear("query:*") + self.clear("sql:*")
-        self._save_to_disk()
-        return count
+        return (
+            self.clear("query:*") + self.clear("sql:*")
+            + self.clear("sql_err:*") + self.clear("gen_sql:*")
+        )
 
     def clear_anomaly_cache(self) -> int:
         """Clear all anomaly caches"""
-        count = self.clear("anomaly:*")
-        self._save_to_disk()
-        return count
+        return self.clear("anomaly:*")
 
 
 # Global instance
 _cache_service = None
+_cache_init_lock = threading.Lock()
 
 
 def get_cache_service() -> CacheService:
     """Get singleton cache service instance"""
     global _cache_service
     if _cache_service is None:
-        _cache_service = CacheService()
+        with _cache_init_lock:
+            if _cache_service is None:
+                _cache_service = CacheService()
     return _cache_service
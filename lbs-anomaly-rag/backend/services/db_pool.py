@@ -1,12 +1,35 @@
 """Database Connection Pool for SQL Server"""
 import pyodbc
 from typing import Optional
-from queue import Queue, Empty
+from queue import LifoQueue, Empty, Full
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from config.settings import settings
+import itertools
 import time
 
 
+class _AtomicCounter:
+    """
+    Lock-free counter for advisory statistics
+
+    itertools.count.__next__ is atomic under the GIL; reads consume one
+    tick of the increment iterator, which is subtracted back out via a
+    second read counter.
+    """
+
+    def __init__(self):
+        self._increments = itertools.count()
+        self._reads = itertools.count()
+
+    def increment(self):
+        next(self._increments)
+
+    @property
+    def value(self) -> int:
+        return next(self._increments) - next(self._reads)
+
+
 class DatabaseConnectionPool:
     """
     Connection pool for SQL Server
@@ -14,62 +37,120 @@ class DatabaseConnectionPool:
     Features:
     - Reuse connections instead of creating new ones
     - Thread-safe connection management
-    - Automatic connection validation
+    - Opt-in pre-ping validation, plus validation of long-idle connections
     - Configurable pool size
     """
 
-    def __init__(self, min_connections: int = 2, max_connections: int = 10):
+    # Waits (seconds) between checkout attempts while the pool is exhausted
+    BACKOFF_STEPS = (0.001, 0.003, 0.01, 0.02, 0.05, 0.1)
+
+    # Rows fetched per ODBC round-trip by cursors handed out via safe_execute
+    CURSOR_ARRAYSIZE = 1000
+
+    # SQLSTATEs meaning the connection itself is gone; anything else (e.g. a
+    # query timeout, HYT00) would fail again, so it is not retried
+    CONNECTION_LOST_STATES = frozenset(("08S01", "08001", "08003", "08007"))
+
+    def __init__(self, min_connections: int = 2, max_connections: int = 10,
+                 pre_ping: bool = False, max_idle_seconds: float = 300):
         """
         Initialize connection pool
 
         Args:
             min_connections: Minimum number of connections to maintain
             max_connections: Maximum number of connections allowed
+            pre_ping: Validate every connection with SELECT 1 on checkout
+            max_idle_seconds: Validate connections idle for longer than this
         """
         self.min_connections = min_connections
         self.max_connections = max_connections
+        self.pre_ping = pre_ping
+        self.max_idle_seconds = max_idle_seconds
         self.connection_string = settings.get_db_connection_string()
 
-        # Connection pool (available connections)
-        self.pool = Queue(maxsize=max_connections)
+        # Connection pool (available connections, most recently returned first)
+        self.pool = LifoQueue(maxsize=max_connections)
 
         # Track active connections
         self.active_connections = 0
         self.lock = Lock()
 
+        # Last-used monotonic timestamps keyed by id(conn); pyodbc
+        # connections don't accept extra attributes
+        self._last_used = {}
+
+        # Every open connection (pooled or checked out), so close_all can reach
+        # connections that were never returned
+        self._connections = {}
+
         # Statistics
         self.stats = {
-            "total_created": 0,
-            "total_requests": 0,
-            "total_returns": 0,
-            "pool_hits": 0,
-            "pool_misses": 0
+            "total_created": _AtomicCounter(),
+            "total_requests": _AtomicCounter(),
+            "total_returns": _AtomicCounter(),
+            "pool_hits": _AtomicCounter(),
+            "pool_misses": _AtomicCounter()
         }
 
         # Initialize minimum connections
         print(f"Initializing database connection pool (min={min_connections}, max={max_connections})")
-        for _ in range(min_connections):
-            try:
-                conn = self._create_connection()
-                self.pool.put(conn)
-            except Exception as e:
-                print(f"Warning: Could not create initial connection: {e}")
+        if min_connections > 0:
+            # Open the initial connections concurrently rather than one RTT at a time
+            with ThreadPoolExecutor(max_workers=min_connections) as executor:
+                futures = [executor.submit(self._create_connection) for _ in range(min_connections)]
+                for future in futures:
+                    try:
+                        self.pool.put(future.result())
+                    except Exception as e:
+                        print(f"Warning: Could not create initial connection: {e}")
 
         print(f"[OK] Connection pool initialized with {self.pool.qsize()} connections")
 
     def _create_connection(self) -> pyodbc.Connection:
         """Create a new database connection"""
         with self.lock:
-            self.stats["total_created"] += 1
             self.active_connections += 1
+        return self._open_connection()
+
+    def _open_connection(self) -> pyodbc.Connection:
+        """Open a connection for a slot already counted in active_connections"""
+        try:
+            conn = pyodbc.connect(
+                self.connection_string,
+                timeout=settings.QUERY_TIMEOUT,
+                autocommit=True
+            )
+        except Exception:
+            with self.lock:
+                self.active_connections -= 1
+            raise
 
-        conn = pyodbc.connect(
-            self.connection_string,
-            timeout=settings.QUERY_TIMEOUT,
-            autocommit=True
-        )
+        self.stats["total_created"].increment()
+        with self.lock:
+            self._last_used[id(conn)] = time.monotonic()
+            self._connections[id(conn)] = conn
         return conn
 
+    def _discard_connection(self, conn: pyodbc.Connection):
+        """Close a dead or surplus connection and release its slot"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            # Only connections still tracked hold a slot; guards double discards
+            self._connections.pop(id(conn), None)
+            if self._last_used.pop(id(conn), None) is not None:
+                self.active_connections -= 1
+
+    def _needs_validation(self, conn: pyodbc.Connection) -> bool:
+        """Whether a pooled connection should be pinged before use"""
+        if self.pre_ping:
+            return True
+        with self.lock:
+            last_used = self._last_used.get(id(conn))
+        return last_used is None or time.monotonic() - last_used > self.max_idle_seconds
+
     def _validate_connection(self, conn: pyodbc.Connection) -> bool:
         """Check if connection is still valid"""
         try:
@@ -93,105 +174,168 @@ class DatabaseConnectionPool:
         Raises:
             Exception: If no connection available within timeout
         """
-        with self.lock:
-            self.stats["total_requests"] += 1
+        self.stats["total_requests"].increment()
 
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
+        backoff = iter(self.BACKOFF_STEPS)
+        wait = next(backoff)
+        conn = None
 
-        # Try to get from pool first
-        try:
-            conn = self.pool.get(block=True, timeout=timeout)
-            self.stats["pool_hits"] += 1
-
-            # Validate connection
-            if self._validate_connection(conn):
-                return conn
-            else:
-                # Connection is stale, create new one
-                print("Warning: Stale connection detected, creating new one")
-                with self.lock:
-                    self.active_connections -= 1
-                return self._create_connection()
+        while True:
+            # Try to get from pool first
+            if conn is None:
+                try:
+                    conn = self.pool.get(block=False)
+                except Empty:
+                    pass
 
-        except Empty:
-            # Pool is empty, try to create new connection if under max
-            with self.lock:
-                if self.active_connections < self.max_connections:
-                    self.stats["pool_misses"] += 1
-                    return self._create_connection()
+            if conn is not None:
+                self.stats["pool_hits"].increment()
+
+                # Dead connections are otherwise caught on first use by safe_execute
+                if not self._needs_validation(conn) or self._validate_connection(conn):
+                    return conn
 
-            # Can't create more connections, wait a bit and retry
-            elapsed = time.time() - start_time
-            if elapsed < timeout:
-                time.sleep(0.1)
-                return self.get_connection(timeout - elapsed)
+                # Connection is stale, drop it and look again
+                print("Warning: Stale connection detected, creating new one")
+                self._discard_connection(conn)
+                conn = None
+                continue
 
-            raise Exception(f"No database connections available after {timeout}s (max={self.max_connections})")
+            # Pool is empty, reserve a slot for a new connection if under max
+            with self.lock:
+                reserved = self.active_connections < self.max_connections
+                if reserved:
+                    self.active_connections += 1
+            if reserved:
+                self.stats["pool_misses"].increment()
+                return self._open_connection()
+
+            # Can't create more connections, wait for a return with backoff
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(f"No database connections available after {timeout}s (max={self.max_connections})")
+            try:
+                conn = self.pool.get(block=True, timeout=min(remaining, wait))
+            except Empty:
+                wait = next(backoff, wait)
 
-    def return_connection(self, conn: pyodbc.Connection):
+    def return_connection(self, conn: pyodbc.Connection, discard: bool = False):
         """
         Return a connection to the pool
 
         Args:
             conn: Connection to return
+            discard: Close the connection instead of reusing it (e.g. its
+                session state could not be reset)
         """
-        with self.lock:
-            self.stats["total_returns"] += 1
+        self.stats["total_returns"].increment()
 
         if conn is None:
             return
 
-        # Validate before returning to pool
-        if self._validate_connection(conn):
-            try:
-                self.pool.put_nowait(conn)
-            except Exception:
-                # Pool is full, close the connection
-                try:
-                    conn.close()
-                except Exception:
-                    pass
-                with self.lock:
-                    self.active_connections -= 1
-        else:
-            # Connection is bad, close it
+        if discard:
+            self._discard_connection(conn)
+            return
+
+        # No validation here; a broken connection is caught by the idle/pre-ping
+        # check on checkout or replaced by safe_execute on first use
+        with self.lock:
+            tracked = id(conn) in self._last_used
+            if tracked:
+                self._last_used[id(conn)] = time.monotonic()
+        if not tracked:
+            # Already discarded (or the pool was closed while it was out)
             try:
                 conn.close()
             except Exception:
                 pass
-            with self.lock:
-                self.active_connections -= 1
+            return
+        try:
+            self.pool.put_nowait(conn)
+        except Full:
+            # Pool is full, close the connection
+            self._discard_connection(conn)
+
+    def _is_connection_lost(self, error: pyodbc.Error) -> bool:
+        """Whether a driver error reports a lost connection (its first arg is the SQLSTATE)"""
+        return bool(error.args) and error.args[0] in self.CONNECTION_LOST_STATES
+
+    def safe_execute(self, conn: pyodbc.Connection, sql: str, *params):
+        """
+        Execute a statement, replacing a dead connection once on disconnect
+
+        Args:
+            conn: Connection obtained from get_connection
+            sql: SQL statement to execute
+            *params: Optional query parameters
+
+        Returns:
+            Tuple of (connection, cursor); the connection may be a fresh
+            replacement and is the one the caller must return to the pool
+        """
+        try:
+            cursor = conn.cursor()
+            cursor.arraysize = self.CURSOR_ARRAYSIZE
+            cursor.execute(sql, *params)
+            return conn, cursor
+        except (pyodbc.OperationalError, pyodbc.InterfaceError) as e:
+            if not self._is_connection_lost(e):
+                raise
+            print(f"Warning: Connection lost ({e}), retrying with a new one")
+            self._discard_connection(conn)
+
+        # Checked out like any other connection, so it counts against max_connections
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.arraysize = self.CURSOR_ARRAYSIZE
+            cursor.execute(sql, *params)
+        except Exception:
+            # The caller still holds the discarded connection, not this one
+            self.return_connection(conn)
+            raise
+        return conn, cursor
 
     def close_all(self):
-        """Close all connections in the pool"""
+        """Close all connections, including ones still checked out"""
         print("Closing all database connections...")
         while not self.pool.empty():
             try:
-                conn = self.pool.get_nowait()
-                conn.close()
-            except Exception:
-                pass
+                self.pool.get_nowait()
+            except Empty:
+                break
 
         with self.lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
             self.active_connections = 0
+            self._last_used.clear()
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
 
         print("[OK] All connections closed")
 
     def get_stats(self) -> dict:
         """Get connection pool statistics"""
-        with self.lock:
-            return {
-                "pool_size": self.pool.qsize(),
-                "active_connections": self.active_connections,
-                "max_connections": self.max_connections,
-                "total_created": self.stats["total_created"],
-                "total_requests": self.stats["total_requests"],
-                "pool_hit_rate": round(
-                    (self.stats["pool_hits"] / self.stats["total_requests"] * 100)
-                    if self.stats["total_requests"] > 0 else 0,
-                    2
-                )
-            }
+        total_requests = self.stats["total_requests"].value
+        pool_hits = self.stats["pool_hits"].value
+        return {
+            "pool_size": self.pool.qsize(),
+            "active_connections": self.active_connections,
+            "max_connections": self.max_connections,
+            "total_created": self.stats["total_created"].value,
+            "total_requests": total_requests,
+            "pool_hit_rate": round(
+                (pool_hits / total_requests * 100)
+                if total_requests > 0 else 0,
+                2
+            )
+        }
 
 
 class PooledConnection:
@@ -202,36 +346,56 @@ class PooledConnection:
         with PooledConnection(pool) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT ...")
+
+    Set ``discard`` to close the connection on exit instead of reusing it.
     """
 
-    def __init__(self, pool: DatabaseConnectionPool):
+    def __init__(self, pool: DatabaseConnectionPool, timeout: float = 5):
         self.pool = pool
+        self.timeout = timeout
         self.conn = None
+        self.discard = False
 
     def __enter__(self) -> pyodbc.Connection:
-        self.conn = self.pool.get_connection()
+        self.conn = self.pool.get_connection(timeout=self.timeout)
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.conn:
-            self.pool.return_connection(self.conn)
+            self.pool.return_connection(self.conn, discard=self.discard)
+
+    def execute(self, sql: str, *params):
+        """Execute on the leased connection, swapping in a new one if it dropped"""
+        self.conn, cursor = self.pool.safe_execute(self.conn, sql, *params)
+        return cursor
 
 
 # Global connection pool
 _connection_pool = None
+_pool_init_lock = Lock()
 
 
 def get_connection_pool() -> DatabaseConnectionPool:
     """Get singleton connection pool instance"""
     global _connection_pool
     if _connection_pool is None:
-        _connection_pool = DatabaseConnectionPool(
-            min_connections=2,
-            max_connections=10
-        )
+        with _pool_init_lock:
+            if _connection_pool is None:
+                _connection_pool = DatabaseConnectionPool(
+                    min_connections=2,
+                    max_connections=10
+                )
     return _connection_pool
 
 
+def close_connection_pool():
+    """Close the singleton pool's connections, if the pool was ever created"""
+    with _pool_init_lock:
+        pool = _connection_pool
+    if pool is not None:
+        pool.close_all()
+
+
 def get_pooled_connection() -> PooledConnection:
     """Get a pooled connection context manager"""
     return PooledConnection(get_connection_pool())
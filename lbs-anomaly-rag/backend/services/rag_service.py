@@ -1,24 +1,235 @@
 """RAG Service for Natural Language to SQL"""
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import datetime
+import decimal
+import hashlib
 import json
+import re
 import pyodbc
-import pandas as pd
+import string
+import sys
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from config.settings import settings
 from services.schema_context import get_schema_context, get_example_queries
+from config.schema_manager import get_schema_manager, get_schema_context_for_tables
+
+try:
+    import sqlglot
+    from sqlglot import exp as sql_exp
+    from sqlglot import tokens as sql_tokens
+    SQLGLOT_AVAILABLE = True
+except ImportError:
+    SQLGLOT_AVAILABLE = False
+
+
+# Statement prefix (after any leading comments, including DISTINCT) and
+# row-limiting clauses checked before injecting TOP
+_SELECT_PREFIX_RE = re.compile(
+    r'^((?:\s|--[^\n]*(?:\n|$)|/\*.*?\*/)*SELECT(?:\s+DISTINCT)?)(\s)',
+    re.IGNORECASE | re.DOTALL
+)
+_LIMIT_RE = re.compile(r'\b(?:TOP|FETCH|OFFSET)\b', re.IGNORECASE)
+
+
+def _outer_select_end(sql: str) -> Optional[int]:
+    """
+    Offset just past the outer statement's SELECT [DISTINCT] keyword(s)
+
+    CTE bodies and subqueries sit inside parentheses, so the outer SELECT is
+    the first one at depth 0.
+    """
+    depth = 0
+    tokens = sqlglot.tokenize(sql, read="tsql")
+    for i, token in enumerate(tokens):
+        if token.token_type == sql_tokens.TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == sql_tokens.TokenType.R_PAREN:
+            depth -= 1
+        elif depth == 0 and token.token_type == sql_tokens.TokenType.SELECT:
+            if i + 1 < len(tokens) and tokens[i + 1].token_type == sql_tokens.TokenType.DISTINCT:
+                token = tokens[i + 1]
+            return token.end + 1
+    return None
+
+
+def _apply_row_limit(sql: str, limit: int) -> str:
+    """
+    Add TOP {limit} to the outer SELECT unless it already limits its rows
+
+    With sqlglot the statement is parsed as T-SQL, so CTEs get the TOP on their
+    final SELECT and a TOP inside a subquery isn't mistaken for the outer one.
+    The TOP is spliced into the original text, so comments and T-SQL syntax
+    are kept as written. Without sqlglot (or when parsing fails) a regex
+    handles the SELECT [DISTINCT] prefix case only.
+    """
+    if SQLGLOT_AVAILABLE:
+        try:
+            tree = sqlglot.parse_one(sql, dialect="tsql")
+        except sqlglot.errors.SqlglotError:
+            tree = None
+
+        if isinstance(tree, sql_exp.Select):
+            if tree.args.get("limit") or tree.args.get("offset"):
+                return sql  # TOP, or OFFSET/FETCH (which can't be combined with TOP)
+            if tree.ctes:
+                end = _outer_select_end(sql)
+                return sql if end is None else f"{sql[:end]} TOP {limit}{sql[end:]}"
+            return _SELECT_PREFIX_RE.sub(rf'\1 TOP {limit}\2', sql, count=1)
+        if tree is not None:
+            return sql  # UNION and other compound statements are left as written
+
+    if not _LIMIT_RE.search(sql):
+        sql = _SELECT_PREFIX_RE.sub(rf'\1 TOP {limit}\2', sql, count=1)
+    return sql
+
+
+# First markdown code block (optionally tagged sql; unterminated runs to the end)
+# and the SELECT keyword that starts the statement
+_CODE_FENCE_RE = re.compile(r'```(?:sql\b)?(.*?)(?:```|$)', re.IGNORECASE | re.DOTALL)
+_SELECT_WORD_RE = re.compile(r'\bSELECT\b', re.IGNORECASE)
+
+# Result values converted to ISO strings for JSON (datetime subclasses date)
+_TEMPORAL_TYPES = (datetime.date, datetime.time)
+
+
+def _json_value(value: Any) -> Any:
+    """Make a driver value JSON-serializable (dates to ISO strings, DECIMAL/MONEY to float)"""
+    if isinstance(value, _TEMPORAL_TYPES):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+# Column-name keywords used to pick chart axes (case-insensitive substrings)
+_PERIOD_COLUMN_RE = re.compile(r'year|month|date|quarter', re.IGNORECASE)
+_AMOUNT_COLUMN_RE = re.compile(r'sales|revenue|amount|total', re.IGNORECASE)
+_MEASURE_COLUMN_RE = re.compile(r'sales|revenue|amount|total|count(?!ry)|quantity', re.IGNORECASE)
+_LABEL_COLUMN_RE = re.compile(r'name|product|customer|country|region', re.IGNORECASE)
+_REGION_COLUMN_RE = re.compile(r'country|region|territory', re.IGNORECASE)
+
+# Chart type and (axis, column keywords) pairs per query intent
+_CHART_SPECS = {
+    "time_series": ("line", (("x", _PERIOD_COLUMN_RE), ("y", _AMOUNT_COLUMN_RE))),
+    "ranking": ("bar", (("x", _LABEL_COLUMN_RE), ("y", _MEASURE_COLUMN_RE))),
+    "geographic": ("bar", (("x", _REGION_COLUMN_RE), ("y", _AMOUNT_COLUMN_RE))),
+    "aggregation": ("metric", (("value", _AMOUNT_COLUMN_RE),)),
+}
+
+
+def _build_system_prompt(schema_context: str) -> str:
+    """SQL generation system prompt for a schema description"""
+    return f"""You are an expert SQL Server query generator for the AdventureWorksDW2019 database.
+Your task is to convert natural language questions into accurate T-SQL queries.
+
+{schema_context}
+
+RULES:
+1. Return ONLY the raw SQL query. No markdown, no explanations, no semicolons, no code fences.
+2. Use table aliases: sal (FactInternetSales), cust (DimCustomer), prod (DimProduct), dt (DimDate), st (DimSalesTerritory), curr (DimCurrency), promo (DimPromotion).
+3. Always INNER JOIN every table you reference. If you use dt.CalendarYear, you MUST have "INNER JOIN DimDate dt ON dt.DateKey = sal.OrderDateKey" in your query.
+4. Never reference a table alias that is not in your FROM or JOIN clauses.
+5. For TOP N queries, always include ORDER BY.
+6. Use DimDate.CalendarYear for year filters, not YEAR() on date columns.
+7. Customer full name: cust.FirstName + ' ' + cust.LastName
+8. Use SUM() for money columns (SalesAmount, etc.), not COUNT().
+9. Include GROUP BY for all non-aggregated columns in SELECT.
+10. "Last year" means the maximum CalendarYear in the data: use (SELECT MAX(CalendarYear) FROM DimDate dt2 INNER JOIN FactInternetSales s2 ON s2.OrderDateKey = dt2.DateKey).
+
+COMMON MISTAKES TO AVOID:
+- Using dt.CalendarYear without joining DimDate
+- Using st.SalesTerritoryCountry without joining DimSalesTerritory
+- Forgetting GROUP BY when using aggregates with other columns
+- Using COUNT() instead of SUM() for SalesAmount
+"""
+
+
+# Full-schema prompt; interned so every caller shares one string object
+_SYSTEM_PROMPT = sys.intern(_build_system_prompt(get_schema_context()))
+
+
+@lru_cache(maxsize=64)
+def _system_prompt_for_tables(tables: frozenset) -> str:
+    """System prompt describing only the given tables, interned like _SYSTEM_PROMPT"""
+    return sys.intern(_build_system_prompt(get_schema_context_for_tables(tables)))
+
+
+# Fingerprint of the prompt inputs; keys the persistent generated-SQL cache
+# so a schema, rules or schema-pruning change invalidates every entry
+_SCHEMA_HASH = hashlib.blake2b(
+    f"{_SYSTEM_PROMPT}\nSCHEMA_TABLES_TOP_K={settings.SCHEMA_TABLES_TOP_K}".encode('utf-8'),
+    digest_size=16
+).hexdigest()
 
 
 class RAGService:
     """Natural language to SQL query service for data warehouse"""
 
+    # Intent keywords in priority order, each compiled to one substring alternation
+    INTENT_PATTERNS = [
+        (intent, re.compile("|".join(re.escape(word) for word in words), re.IGNORECASE))
+        for intent, words in [
+            ("ranking", ["top", "best", "highest", "most", "largest"]),
+            ("aggregation", ["total", "sum", "aggregate"]),
+            ("time_series", ["trend", "over time", "monthly", "yearly", "growth"]),
+            ("customer_analysis", ["customer", "who", "buyer"]),
+            ("product_analysis", ["product", "item", "sold"]),
+            ("geographic", ["country", "territory", "region", "geographic"]),
+            ("promotion", ["promotion", "discount", "campaign"]),
+        ]
+    ]
+
+    # Maximum number of questions kept in the generated-SQL cache
+    GENERATED_SQL_CACHE_SIZE = 512
+
+    # Dimensions kept in every pruned schema prompt; the rules always mention them
+    ALWAYS_INCLUDED_TABLES = frozenset({"DimDate"})
+
+    # Schema text is immutable at runtime; build it once for all instances
+    schema_context = get_schema_context()
+
     def __init__(self, use_vector_search: bool = True, use_cache: bool = True):
-        self.schema_context = get_schema_context()
         self.example_queries = get_example_queries()
         self.llama_url = settings.LLAMA_SERVER_URL
         self.model = settings.LLAMA_MODEL
         self.use_vector_search = use_vector_search
         self.use_cache = use_cache
 
+        self._last_examples_prefix = (None, None)
+
+        # Prompt prefix for the first 5 hardcoded examples, used without vector search
+        self._default_examples_prefix = self._build_examples_prefix(self.example_queries[:5])
+
+        # Exact-match LRU of generated SQL keyed by normalized question
+        self._generated_sql: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._generated_sql_lock = threading.Lock()
+
+        # Background writer for fire-and-forget generated-SQL cache updates
+        self._cache_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-cache")
+
+        # In-flight query() calls keyed by normalized question, for request coalescing
+        self._inflight: Dict[tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+        # Keep-alive HTTP session so LLM calls (including batch workers) reuse
+        # pooled connections instead of paying TCP/TLS setup per request
+        self._http = requests.Session()
+        self._http.headers['Connection'] = 'keep-alive'
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(16, settings.LLAMA_MAX_CONCURRENCY),
+            max_retries=Retry(total=2, backoff_factor=0.2)
+        )
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
+
         # Initialize cache if enabled
         self.cache = None
         if self.use_cache:
@@ -41,55 +252,231 @@ class RAGService:
                 print("  Falling back to hardcoded examples")
                 self.use_vector_search = False
 
-    def _get_db_connection(self):
-        """Get database connection from pool"""
+        # Per-table embeddings for schema retrieval; None sends the full schema
+        self._table_index = None
+        if self.vector_store and settings.SCHEMA_TABLES_TOP_K > 0:
+            try:
+                self._table_index = self._build_table_index()
+            except Exception as e:
+                print(f"[WARN] Schema table index failed: {e}, using full schema")
+
+        # Auto-learn writes (embedding + disk) happen off the request path
+        self._learn_queue = queue.Queue(maxsize=1024)
+        if self.vector_store:
+            threading.Thread(target=self._learn_worker, daemon=True).start()
+
+    def _build_table_index(self):
+        """Embed each dimension table's description once, for schema retrieval"""
+        manager = get_schema_manager()
+        fact_tables = frozenset(table['name'] for table in manager.get_fact_tables())
+        dimensions = [table['name'] for table in manager.get_dimension_tables()]
+        matrix = self.vector_store.encode_batch(
+            [manager.get_table_search_text(name) for name in dimensions]
+        )
+        # Finds the dimension tables a few-shot example's SQL joins
+        table_re = re.compile(r'\b(' + '|'.join(map(re.escape, dimensions)) + r')\b', re.IGNORECASE)
+        pinned = fact_tables | (self.ALWAYS_INCLUDED_TABLES & frozenset(dimensions))
+        return pinned, dimensions, matrix, table_re
+
+    def _system_prompt_for(self, question: str, examples: List[Dict[str, Any]] = ()) -> str:
+        """
+        System prompt with the schema of the tables relevant to a question
+
+        Fact tables and ALWAYS_INCLUDED_TABLES are always included, plus every
+        dimension the few-shot examples' SQL references (the model copies their
+        joins) and the SCHEMA_TABLES_TOP_K dimensions closest to the question.
+        The table set is a frozenset, so the same tables always yield the
+        identical prompt and keep server-side prefix caching. Falls back to the
+        full schema.
+        """
+        if self._table_index is None:
+            return _SYSTEM_PROMPT
+        pinned, dimensions, matrix, table_re = self._table_index
+        by_name = {name.lower(): name for name in dimensions}
+        referenced = {
+            by_name[match.lower()]
+            for example in examples
+            for match in table_re.findall(example.get('sql', ''))
+        }
         try:
-            from services.db_pool import get_connection_pool
-            pool = get_connection_pool()
-            return pool.get_connection()
-        except Exception:
-            # Fallback to direct connection
-            conn_str = settings.get_db_connection_string()
-            return pyodbc.connect(conn_str, timeout=settings.QUERY_TIMEOUT)
-
-    def _call_llama(self, prompt: str, system_prompt: str = None) -> str:
-        """Call Llama API for text generation"""
+            # Shares the store's embedding cache with search_similar_queries
+            query = self.vector_store.encode(question)
+        except Exception as e:
+            print(f"[WARN] Schema table retrieval failed: {e}, using full schema")
+            return _SYSTEM_PROMPT
+        closest = matrix.dot(query).argsort()[::-1][:settings.SCHEMA_TABLES_TOP_K]
+        return _system_prompt_for_tables(pinned | referenced | {dimensions[i] for i in closest})
+
+    @contextmanager
+    def _borrow_conn(self):
+        """Lease a pooled database connection for the duration of a with-block"""
+        from services.db_pool import PooledConnection, get_connection_pool
+        lease = PooledConnection(get_connection_pool(), timeout=settings.POOL_WAIT_TIMEOUT)
+        with lease:
+            yield lease
+
+    def _call_llama(self, prompt: str, system_prompt: str = None, stop_at_sql_end: bool = False,
+                    prompt_prefix: str = "") -> str:
+        """
+        Call Llama API for text generation
+
+        The response is streamed. With stop_at_sql_end, reading stops as soon as
+        the SQL statement is complete and the connection is closed, which also
+        stops Ollama generating the unused tail; stop sequences let the server
+        halt on its own when the model starts another example.
+
+        prompt_prefix is the reusable leading part of the prompt (few-shot
+        examples); providers with block-level prompt caching get it as its own
+        cacheable block.
+        """
+        if settings.LLM_PROVIDER == "anthropic":
+            return self._call_anthropic(prompt, system_prompt, stop_at_sql_end, prompt_prefix)
+
         try:
             url = f"{self.llama_url}/api/generate"
 
             payload = {
                 "model": self.model,
-                "prompt": prompt,
-                "stream": False,
+                "prompt": prompt_prefix + prompt,
+                "stream": True,
                 "options": {
                     "temperature": 0.1,  # Low temperature for more deterministic SQL
                     "top_p": 0.9,
-                    "num_predict": 1000
+                    "num_predict": 400  # Hard cap on decode time; SQL rarely needs more
                 }
             }
 
+            if stop_at_sql_end:
+                payload["options"]["stop"] = ["```\n\n", "Question:"]
+
             if system_prompt:
                 payload["system"] = system_prompt
 
-            response = requests.post(url, json=payload, timeout=60)
-            response.raise_for_status()
+            # Ask llama.cpp-style servers to keep the prompt KV cache (Ollama does so by default)
+            payload["cache_prompt"] = True
 
-            result = response.json()
-            return result.get("response", "").strip()
+            response = self._http.post(url, json=payload, timeout=60, stream=True)
+            try:
+                response.raise_for_status()
+
+                pieces = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    piece = chunk.get("response", "")
+                    pieces.append(piece)
+                    if chunk.get("done"):
+                        break
+                    # Only a newline, fence or semicolon can complete the statement
+                    if stop_at_sql_end and ("\n" in piece or "`" in piece or ";" in piece) \
+                            and self._sql_complete("".join(pieces)):
+                        break
+            finally:
+                response.close()
+
+            return "".join(pieces).strip()
 
         except requests.exceptions.RequestException as e:
             raise Exception(f"Error calling Llama API: {e}")
 
-    def generate_sql(self, question: str) -> Dict[str, Any]:
+    def _call_anthropic(self, prompt: str, system_prompt: Optional[str], stop_at_sql_end: bool,
+                        prompt_prefix: str) -> str:
+        """
+        Call the Anthropic Messages API for text generation
+
+        The system prompt and the few-shot prefix are sent as separate content
+        blocks marked cache_control, so only the question is billed and
+        prefilled at full cost on repeat calls.
+        """
+        ephemeral = {"type": "ephemeral"}
+        content = []
+        if prompt_prefix:
+            content.append({"type": "text", "text": prompt_prefix, "cache_control": ephemeral})
+        content.append({"type": "text", "text": prompt})
+
+        payload = {
+            "model": settings.ANTHROPIC_MODEL,
+            "max_tokens": 400,
+            "temperature": 0.1,
+            "messages": [{"role": "user", "content": content}]
+        }
+        if system_prompt:
+            payload["system"] = [{"type": "text", "text": system_prompt, "cache_control": ephemeral}]
+        if stop_at_sql_end:
+            payload["stop_sequences"] = ["```\n\n", "Question:"]
+
+        headers = {
+            "x-api-key": settings.ANTHROPIC_API_KEY,
+            "anthropic-version": "2023-06-01"
+        }
+
+        try:
+            response = self._http.post(
+                f"{settings.ANTHROPIC_API_URL}/v1/messages",
+                json=payload,
+                headers=headers,
+                timeout=60
+            )
+            response.raise_for_status()
+            blocks = response.json().get("content", [])
+            return "".join(block.get("text", "") for block in blocks if block.get("type") == "text").strip()
+
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error calling Anthropic API: {e}")
+
+    @staticmethod
+    def _sql_complete(text: str) -> bool:
+        """Whether streamed LLM output already holds a finished SELECT statement"""
+        select = _SELECT_WORD_RE.search(text)
+        if select is None:
+            return False
+        start = select.start()
+
+        tail = text[start:]
+        if text.count("```", 0, start) % 2 == 1:
+            # SELECT is inside a code fence; wait for the closing fence
+            return "```" in tail
+        # Terminated statement with no fence left open, or a blank line after it
+        return (tail.rstrip().endswith(";") and tail.count("```") % 2 == 0) or "\n\n" in tail
+
+    def generate_sql(self, question: str, intent: Optional[str] = None, persist: bool = True) -> Dict[str, Any]:
         """
         Generate SQL query from natural language question
 
         Args:
             question: Natural language question
+            intent: Precomputed intent classification, if already available
+            persist: Write new SQL to the persistent cache now; callers that
+                execute it first pass False and persist once it has run
 
         Returns:
             Dictionary with sql, intent, and explanation
         """
+        # Repeated questions skip the LLM entirely
+        key = self._normalize_question(question)
+        with self._generated_sql_lock:
+            cached = self._generated_sql.get(key)
+            if cached is not None:
+                self._generated_sql.move_to_end(key)
+        if cached is None and self.use_cache and self.cache:
+            # Persistent cache survives restarts; promote hits into the LRU
+            cached = self.cache.get_generated_sql_cache(_SCHEMA_HASH, key)
+            if cached is not None:
+                self._remember_generated_sql(question, cached["sql"], cached["intent"], persist=False)
+        if cached is not None:
+            return {
+                "sql": cached["sql"],
+                "intent": cached["intent"],
+                "explanation": self._generate_explanation(question, cached["sql"], cached["intent"])
+            }
+
+        # Schema and rules go in the constant system prompt and the examples lead
+        # the prompt, so only the question varies as a strict suffix and the
+        # server can reuse its KV cache for everything before it
+        examples_prefix = self._default_examples_prefix
+        examples = self.example_queries[:5]
+
         # Get relevant examples using semantic search or fallback to hardcoded
         if self.use_vector_search and self.vector_store:
             try:
@@ -98,69 +485,87 @@ class RAGService:
                     question=question,
                     n_results=5
                 )
-                examples_to_use = similar_examples
+                examples_prefix = self._examples_prefix_for(similar_examples)
+                examples = similar_examples
             except Exception as e:
                 print(f"[WARN] Vector search failed: {e}, using hardcoded examples")
-                examples_to_use = self.example_queries[:5]
-        else:
-            # Use first 5 hardcoded examples
-            examples_to_use = self.example_queries[:5]
-
-        # Build few-shot examples text
-        examples_text = "\n\n".join([
-            f"Question: {ex['question']}\nIntent: {ex.get('intent', 'general_query')}\nSQL:\n{ex.get('sql', '')}"
-            for ex in examples_to_use
-        ])
-
-        system_prompt = f"""You are an expert SQL Server query generator for the AdventureWorksDW2019 database.
-Your task is to convert natural language questions into accurate T-SQL queries.
-
-{self.schema_context}
-
-EXAMPLE QUERIES:
-{examples_text}
-
-RULES:
-1. Return ONLY the raw SQL query. No markdown, no explanations, no semicolons, no code fences.
-2. Use table aliases: sal (FactInternetSales), cust (DimCustomer), prod (DimProduct), dt (DimDate), st (DimSalesTerritory), curr (DimCurrency), promo (DimPromotion).
-3. Always INNER JOIN every table you reference. If you use dt.CalendarYear, you MUST have "INNER JOIN DimDate dt ON dt.DateKey = sal.OrderDateKey" in your query.
-4. Never reference a table alias that is not in your FROM or JOIN clauses.
-5. For TOP N queries, always include ORDER BY.
-6. Use DimDate.CalendarYear for year filters, not YEAR() on date columns.
-7. Customer full name: cust.FirstName + ' ' + cust.LastName
-8. Use SUM() for money columns (SalesAmount, etc.), not COUNT().
-9. Include GROUP BY for all non-aggregated columns in SELECT.
-10. "Last year" means the maximum CalendarYear in the data: use (SELECT MAX(CalendarYear) FROM DimDate dt2 INNER JOIN FactInternetSales s2 ON s2.OrderDateKey = dt2.DateKey).
 
-COMMON MISTAKES TO AVOID:
-- Using dt.CalendarYear without joining DimDate
-- Using st.SalesTerritoryCountry without joining DimSalesTerritory
-- Forgetting GROUP BY when using aggregates with other columns
-- Using COUNT() instead of SUM() for SalesAmount
-"""
-
-        prompt = f"""Question: {question}
+        prompt = f"""Question: {question.strip()}
 
 SQL:"""
 
         # Get SQL from LLM
-        sql_response = self._call_llama(prompt, system_prompt)
+        sql_response = self._call_llama(
+            prompt, self._system_prompt_for(question, examples), stop_at_sql_end=True,
+            prompt_prefix=examples_prefix
+        )
 
         # Clean up the response
         sql_query = self._extract_sql(sql_response)
 
         # Determine intent
-        intent = self._classify_intent(question)
+        if intent is None:
+            intent = self._classify_intent(question)
 
         # Generate explanation
         explanation = self._generate_explanation(question, sql_query, intent)
 
+        self._remember_generated_sql(question, sql_query, intent, persist=persist)
+
         return {
             "sql": sql_query,
             "intent": intent,
             "explanation": explanation
         }
 
+    def _examples_prefix_for(self, examples: List[Dict[str, Any]]) -> str:
+        """Few-shot prompt prefix for retrieved examples, reusing the last one if unchanged"""
+        examples_key = tuple(
+            (ex['question'], ex.get('intent'), ex.get('sql', '')) for ex in examples
+        )
+        last_key, last_prefix = self._last_examples_prefix
+        if examples_key == last_key:
+            return last_prefix
+
+        examples_prefix = self._build_examples_prefix(examples)
+        self._last_examples_prefix = (examples_key, examples_prefix)
+        return examples_prefix
+
+    @staticmethod
+    def _build_examples_prefix(examples: List[Dict[str, Any]]) -> str:
+        """Format few-shot examples as the leading block of the generation prompt"""
+        examples_text = "\n\n".join([
+            f"Question: {ex['question']}\nIntent: {ex.get('intent', 'general_query')}\nSQL:\n{ex.get('sql', '').strip()}"
+            for ex in examples
+        ])
+        return f"EXAMPLE QUERIES:\n{examples_text}\n\n"
+
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        """Cache key for a question: case-folded, whitespace collapsed, outer punctuation stripped"""
+        return " ".join(question.casefold().split()).strip(string.punctuation + " ")
+
+    def _remember_generated_sql(self, question: str, sql: str, intent: str, persist: bool = True):
+        """Store a question's generated SQL in the exact-match LRU and, if enabled, the persistent cache"""
+        key = self._normalize_question(question)
+        entry = {"sql": sql, "intent": intent}
+        with self._generated_sql_lock:
+            self._generated_sql[key] = entry
+            self._generated_sql.move_to_end(key)
+            while len(self._generated_sql) > self.GENERATED_SQL_CACHE_SIZE:
+                self._generated_sql.popitem(last=False)
+        if persist and self.use_cache and self.cache:
+            # Fire-and-forget so a Redis round-trip doesn't delay the response
+            self._cache_writer.submit(self.cache.set_generated_sql_cache, _SCHEMA_HASH, key, entry)
+
+    def _forget_generated_sql(self, question: str):
+        """Drop a question's generated SQL, e.g. after it failed to execute"""
+        key = self._normalize_question(question)
+        with self._generated_sql_lock:
+            self._generated_sql.pop(key, None)
+        if self.use_cache and self.cache:
+            self.cache.delete_generated_sql_cache(_SCHEMA_HASH, key)
+
     def _retry_with_error(self, question: str, failed_sql: str, error: str) -> str:
         """Ask the LLM to fix a failed SQL query based on the error message"""
         system_prompt = f"""You are an expert SQL Server query fixer. A query failed with an error.
@@ -181,49 +586,28 @@ Original question: {question}
 
 Write the corrected SQL query:"""
 
-        response = self._call_llama(prompt, system_prompt)
+        response = self._call_llama(prompt, system_prompt, stop_at_sql_end=True)
         return self._extract_sql(response)
 
     def _extract_sql(self, response: str) -> str:
         """Extract SQL query from LLM response"""
-        # Remove markdown code blocks
-        sql = response.strip()
-
-        if "```sql" in sql:
-            sql = sql.split("```sql")[1].split("```")[0].strip()
-        elif "```" in sql:
-            sql = sql.split("```")[1].split("```")[0].strip()
-
-        # Remove any leading/trailing whitespace
-        sql = sql.strip()
+        # Take the body of the first markdown code block, if any
+        fence = _CODE_FENCE_RE.search(response)
+        sql = fence.group(1) if fence else response
 
         # Remove any explanatory text before SELECT
-        if "SELECT" in sql.upper():
-            select_idx = sql.upper().find("SELECT")
-            sql = sql[select_idx:]
+        select = _SELECT_WORD_RE.search(sql)
+        if select:
+            sql = sql[select.start():]
 
-        return sql
+        return sql.strip()
 
     def _classify_intent(self, question: str) -> str:
         """Classify the intent of the question"""
-        question_lower = question.lower()
-
-        if any(word in question_lower for word in ["top", "best", "highest", "most", "largest"]):
-            return "ranking"
-        elif any(word in question_lower for word in ["total", "sum", "aggregate"]):
-            return "aggregation"
-        elif any(word in question_lower for word in ["trend", "over time", "monthly", "yearly", "growth"]):
-            return "time_series"
-        elif any(word in question_lower for word in ["customer", "who", "buyer"]):
-            return "customer_analysis"
-        elif any(word in question_lower for word in ["product", "item", "sold"]):
-            return "product_analysis"
-        elif any(word in question_lower for word in ["country", "territory", "region", "geographic"]):
-            return "geographic"
-        elif any(word in question_lower for word in ["promotion", "discount", "campaign"]):
-            return "promotion"
-        else:
-            return "general_query"
+        for intent, pattern in self.INTENT_PATTERNS:
+            if pattern.search(question):
+                return intent
+        return "general_query"
 
     def _generate_explanation(self, question: str, sql: str, intent: str) -> str:
         """Generate a simple explanation of what the query does"""
@@ -253,10 +637,7 @@ Write the corrected SQL query:"""
             Dictionary with data, row_count, and columns
         """
         # Add TOP clause if not present and no other limiting clause
-        sql_upper = sql.upper().strip()
-        if not any(keyword in sql_upper for keyword in ["TOP ", "FETCH ", "OFFSET "]):
-            if sql_upper.startswith("SELECT"):
-                sql = sql[:6] + f" TOP {limit}" + sql[6:]
+        sql = _apply_row_limit(sql, limit)
 
         # Check SQL-level cache first (same SQL = same results, regardless of question)
         if self.use_cache and self.cache:
@@ -265,30 +646,30 @@ Write the corrected SQL query:"""
                 cached["sql_cache_hit"] = True
                 return cached
 
-        conn = None
-        try:
-            conn = self._get_db_connection()
-
-            # Execute query
-            df = pd.read_sql(sql, conn)
-
-            # Convert to list of dictionaries
-            data = df.to_dict('records')
+            # Recently failed SQL fails again without a database round-trip
+            cached_error = self.cache.get_sql_error_cache(sql)
+            if cached_error:
+                cached_error["sql_cache_hit"] = True
+                return cached_error
 
-            # Convert any non-serializable types
-            for row in data:
-                for key, value in row.items():
-                    if pd.isna(value):
-                        row[key] = None
-                    elif hasattr(value, 'isoformat'):  # datetime
-                        row[key] = value.isoformat()
-                    elif isinstance(value, (pd.Timestamp, pd.DatetimeTZDtype)):
-                        row[key] = str(value)
+        try:
+            with self._borrow_conn() as lease:
+                # Execute query (a dropped connection is replaced and retried once)
+                cursor = lease.execute(sql)
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchmany(limit)
+                cursor.close()
+
+            # Build row dictionaries directly, making dates and decimals JSON-serializable
+            data = [
+                {col: _json_value(value) for col, value in zip(columns, row)}
+                for row in rows
+            ]
 
             result = {
                 "data": data,
                 "row_count": len(data),
-                "columns": list(df.columns),
+                "columns": columns,
                 "success": True
             }
 
@@ -299,31 +680,47 @@ Write the corrected SQL query:"""
             return result
 
         except Exception as e:
-            return {
+            result = {
                 "data": [],
                 "row_count": 0,
                 "columns": [],
                 "success": False,
                 "error": str(e)
             }
-        finally:
-            # Return connection to pool
-            if conn:
-                try:
-                    from services.db_pool import get_connection_pool
-                    pool = get_connection_pool()
-                    pool.return_connection(conn)
-                except Exception:
-                    # Fallback: just close it
-                    try:
-                        conn.close()
-                    except Exception:
-                        pass
+
+            # Cache SQL errors briefly; connectivity failures are not the query's fault
+            if isinstance(e, pyodbc.ProgrammingError) and self.use_cache and self.cache:
+                self.cache.set_sql_error_cache(sql, result, ttl=60)
+
+            return result
+
+    def warm_cache(self, limit: int = 100) -> int:
+        """
+        Pre-populate the SQL result cache with the example queries
+
+        Args:
+            limit: Row limit applied when executing each example
+
+        Returns:
+            Number of examples executed successfully
+        """
+        if not (self.use_cache and self.cache):
+            return 0
+
+        warmed = 0
+        for example in self.example_queries:
+            if self.execute_query(example["sql"], limit).get("success"):
+                warmed += 1
+
+        print(f"[OK] SQL cache warmed with {warmed}/{len(self.example_queries)} example queries")
+        return warmed
 
     def query(self, question: str, execute: bool = True, limit: int = 100) -> Dict[str, Any]:
         """
         Complete RAG pipeline: question -> SQL -> results
 
+        Identical questions arriving concurrently share a single pipeline run.
+
         Args:
             question: Natural language question
             execute: Whether to execute the query
@@ -332,7 +729,68 @@ Write the corrected SQL query:"""
         Returns:
             Dictionary with SQL, data, and metadata
         """
-        # Check cache first
+        key = (" ".join(question.casefold().split()), execute, limit)
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            return dict(future.result())
+
+        try:
+            result = self._run_query(question, execute, limit)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def batch_query(self, questions: List[str], execute: bool = True, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Run several questions concurrently
+
+        Concurrent requests let the LLM server batch decoding and share the cached
+        system prompt prefix. Concurrency is capped at settings.LLAMA_MAX_CONCURRENCY.
+
+        Args:
+            questions: Natural language questions
+            execute: Whether to execute the queries
+            limit: Maximum rows to return per query
+
+        Returns:
+            One result per question, in order; failures carry success=False and error
+        """
+        if not questions:
+            return []
+
+        def run_one(question: str) -> Dict[str, Any]:
+            try:
+                return self.query(question, execute, limit)
+            except Exception as e:
+                return {
+                    "question": question,
+                    "sql": "",
+                    "intent": "",
+                    "explanation": "",
+                    "success": False,
+                    "error": str(e)
+                }
+
+        # One worker per question, capped at the LLM server's concurrency
+        max_workers = max(1, min(len(questions), settings.LLAMA_MAX_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-batch") as executor:
+            return list(executor.map(run_one, questions))
+
+    def _run_query(self, question: str, execute: bool, limit: int) -> Dict[str, Any]:
+        """Run the RAG pipeline for one question (see query)"""
+        # Both are cheap lookups; running them inline avoids two thread handoffs
         if self.use_cache and self.cache:
             cached_result = self.cache.get_query_cache(question, execute)
             if cached_result:
@@ -340,7 +798,11 @@ Write the corrected SQL query:"""
                 return cached_result
 
         # Generate SQL
-        generation_result = self.generate_sql(question)
+        # When executing, the SQL is only persisted once it has run successfully,
+        # which keeps the cache write out of the LLM -> DB critical path
+        generation_result = self.generate_sql(
+            question, intent=self._classify_intent(question), persist=not execute
+        )
 
         result = {
             "question": question,
@@ -383,12 +845,19 @@ Write the corrected SQL query:"""
                     # All retries exhausted
                     result.update(execution_result)
 
+            if not result.get("success"):
+                # Don't keep serving SQL that never ran successfully
+                self._forget_generated_sql(question)
+            else:
+                # Persist the SQL that ran (the self-corrected version after retries)
+                self._remember_generated_sql(question, result["sql"], result["intent"])
+
         # Auto-learn: add successful queries to vector store
         if execute and result.get("success") and self.vector_store:
             try:
-                self._auto_learn(question, result["sql"], result["intent"])
-            except Exception as e:
-                print(f"[WARN] Auto-learn failed: {e}")
+                self._learn_queue.put_nowait((question, result["sql"], result["intent"]))
+            except queue.Full:
+                pass  # Learning is best-effort; drop under backlog
 
         # Cache the result (1 hour for executed queries, 2 hours for SQL-only)
         # AdventureWorks data is static, so longer TTLs are safe
@@ -398,6 +867,15 @@ Write the corrected SQL query:"""
 
         return result
 
+    def _learn_worker(self):
+        """Background worker draining queued auto-learn examples"""
+        while True:
+            question, sql, intent = self._learn_queue.get()
+            try:
+                self._auto_learn(question, sql, intent)
+            except Exception as e:
+                print(f"[WARN] Auto-learn failed: {e}")
+
     def _auto_learn(self, question: str, sql: str, intent: str):
         """Add successful query to vector store if it's sufficiently novel"""
         if not self.vector_store:
@@ -426,15 +904,18 @@ Write the corrected SQL query:"""
             Dictionary with validation status and messages
         """
         try:
-            conn = self._get_db_connection()
-            cursor = conn.cursor()
-
-            # Use SET NOEXEC ON to parse without executing
-            cursor.execute("SET NOEXEC ON")
-            cursor.execute(sql)
-            cursor.execute("SET NOEXEC OFF")
-
-            conn.close()
+            with self._borrow_conn() as lease:
+                cursor = lease.conn.cursor()
+                try:
+                    # Use SET NOEXEC ON to parse without executing
+                    cursor.execute("SET NOEXEC ON")
+                    cursor.execute(sql)
+                finally:
+                    # Reset the session before reuse; drop the connection if that fails
+                    try:
+                        cursor.execute("SET NOEXEC OFF")
+                    except Exception:
+                        lease.discard = True
 
             return {
                 "valid": True,
@@ -462,34 +943,20 @@ Write the corrected SQL query:"""
         if not data or not columns:
             return None
 
-        chart_config = {
-            "time_series": {
-                "type": "line",
-                "x": self._find_column(columns, ["year", "month", "date", "quarter"]),
-                "y": self._find_column(columns, ["sales", "revenue", "amount", "total"])
-            },
-            "ranking": {
-                "type": "bar",
-                "x": self._find_column(columns, ["name", "product", "customer", "country", "region"]),
-                "y": self._find_column(columns, ["sales", "revenue", "amount", "total", "count", "quantity"])
-            },
-            "geographic": {
-                "type": "bar",
-                "x": self._find_column(columns, ["country", "region", "territory"]),
-                "y": self._find_column(columns, ["sales", "revenue", "amount", "total"])
-            },
-            "aggregation": {
-                "type": "metric",
-                "value": self._find_column(columns, ["total", "sales", "amount", "revenue"])
-            }
-        }
+        # Only the requested intent's columns are looked up
+        spec = _CHART_SPECS.get(intent)
+        if spec is None:
+            return None
 
-        return chart_config.get(intent)
+        chart_type, axes = spec
+        chart = {"type": chart_type}
+        for axis, keywords in axes:
+            chart[axis] = self._find_column(columns, keywords)
+        return chart
 
-    def _find_column(self, columns: List[str], keywords: List[str]) -> Optional[str]:
-        """Find first column matching any keyword"""
+    def _find_column(self, columns: List[str], keywords: re.Pattern) -> Optional[str]:
+        """Find first column matching a compiled keyword alternation"""
         for col in columns:
-            col_lower = col.lower()
-            if any(keyword in col_lower for keyword in keywords):
+            if keywords.search(col):
                 return col
         return columns[0] if columns else None
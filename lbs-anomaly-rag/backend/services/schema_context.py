@@ -1,26 +1,23 @@
 """Schema context for LLM-based SQL generation"""
 import sys
 import os
+from functools import lru_cache
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from config.schema_manager import get_schema_manager
-
-
-def get_schema_context():
-    """
-    Return the schema context for RAG
-
-    This now dynamically loads from schema_config.json
-    making it easy to maintain and update
-    """
-    manager = get_schema_manager()
-    return manager.generate_schema_context_text() + "\n\n" + manager.get_joins_text()
+# Schema text and lookups live in the schema manager; re-exported here for callers
+from config.schema_manager import (
+    get_schema_manager,
+    get_schema_context,
+    get_table_list,
+    get_column_list,
+)
 
 
+@lru_cache(maxsize=1)
 def get_example_queries():
-    """Return example natural language queries and their SQL"""
+    """Return example natural language queries and their SQL (shared; don't mutate)"""
     return [
         {
             "question": "What were the total sales in 2013?",
@@ -144,18 +141,6 @@ ORDER BY dt.FiscalYear, dt.FiscalQuarter
     ]
 
 
-def get_table_list():
-    """Get list of all table names"""
-    manager = get_schema_manager()
-    return manager.get_table_list()
-
-
-def get_column_list(table_name: str):
-    """Get list of column names for a table"""
-    manager = get_schema_manager()
-    return manager.get_column_list(table_name)
-
-
 def get_fact_tables():
     """Get list of fact tables"""
     manager = get_schema_manager()
@@ -1,19 +1,119 @@
 """Vector Store Service for Semantic Search over Queries
 
-Uses SentenceTransformer embeddings with numpy-based cosine similarity search.
-Persists data to a JSON file for durability.
+Uses SentenceTransformer embeddings with numpy-based cosine similarity search
+over int8-quantized vectors. Persists documents to a JSON file and embeddings
+to .npy files.
 """
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Any, Optional
+from collections import defaultdict
+from functools import lru_cache
+import atexit
 import os
 import json
+import threading
 from datetime import datetime
+from uuid import uuid4
+from config.settings import settings
+
+try:
+    from numba import njit, prange, get_num_threads
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+
+def _int8_similarities_numpy(matrix: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Cosine similarities of int8 rows (value = row * scale) against a normalized float32 query"""
+    return (matrix @ query) * scales
+
+
+def _int8_top_k_numpy(matrix: np.ndarray, scales: np.ndarray, query: np.ndarray, k: int, mask: np.ndarray = None):
+    """Indices and similarities of the k most similar rows (only rows set in mask, if given), best first"""
+    similarities = _int8_similarities_numpy(matrix, scales, query)
+    if mask is not None:
+        similarities[~mask] = -np.inf
+    if k < len(similarities):
+        # Partial selection is O(N); only the k winners get sorted
+        candidates = np.argpartition(-similarities, k - 1)[:k]
+        top_indices = candidates[np.argsort(-similarities[candidates])]
+    else:
+        top_indices = np.argsort(-similarities)
+    return top_indices, similarities[top_indices]
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _int8_top_k_chunks(matrix, scales, query, k, n_chunks, mask):
+        """
+        Scores and keeps the k best rows of each chunk in a single pass,
+        without materializing the full similarity vector
+        """
+        n, d = matrix.shape
+        best_sims = np.full((n_chunks, k), -np.inf, dtype=np.float32)
+        best_rows = np.full((n_chunks, k), -1, dtype=np.int64)
+        chunk = (n + n_chunks - 1) // n_chunks
+        for c in prange(n_chunks):
+            for i in range(c * chunk, min(n, (c + 1) * chunk)):
+                if not mask[i]:
+                    continue
+                acc = np.int32(0)
+                for j in range(d):
+                    acc += np.int32(matrix[i, j]) * np.int32(query[j])
+                sim = np.float32(acc * scales[i])
+                if sim > best_sims[c, k - 1]:
+                    # Insertion into the sorted per-chunk list (k is small)
+                    pos = k - 1
+                    while pos > 0 and best_sims[c, pos - 1] < sim:
+                        best_sims[c, pos] = best_sims[c, pos - 1]
+                        best_rows[c, pos] = best_rows[c, pos - 1]
+                        pos -= 1
+                    best_sims[c, pos] = sim
+                    best_rows[c, pos] = i
+        return best_sims.ravel(), best_rows.ravel()
+
+    def _int8_top_k(matrix: np.ndarray, scales: np.ndarray, query: np.ndarray, k: int, mask: np.ndarray = None):
+        """Fused similarity + top-k kernel, same results as the numpy path within rounding"""
+        query_scale = np.float32(np.abs(query).max() / 127.0)
+        query_i8 = np.round(query / query_scale).astype(np.int8)
+        n_chunks = max(1, min(get_num_threads(), len(matrix) // k))
+        if mask is None:
+            mask = np.ones(len(matrix), dtype=np.bool_)
+        sims, rows = _int8_top_k_chunks(matrix, scales, query_i8, k, n_chunks, mask)
+        # Merge the per-chunk winners; stable so ties keep row order
+        order = np.argsort(-sims, kind="stable")[:k]
+        order = order[rows[order] >= 0]
+        return rows[order], sims[order] * query_scale
+else:
+    _int8_top_k = _int8_top_k_numpy
 
 
 class VectorStore:
     """Manages embeddings and semantic search for queries"""
 
+    # all-MiniLM-L6-v2 output size
+    EMBEDDING_DIM = 384
+
+    # Below this many examples exact search beats an approximate (HNSW) index
+    ANN_MIN_EXAMPLES = 1000
+
+    # Intent buckets larger than this share of the store are scored in place
+    # with a row mask; smaller ones are gathered into a compact matrix first
+    INTENT_MASK_MIN_FRACTION = 0.2
+
     def __init__(self, persist_directory: str = None):
         """
         Initialize vector store with local persistence
@@ -26,40 +126,325 @@ class VectorStore:
             persist_directory = os.path.join(base_dir, "chroma_db")
 
         os.makedirs(persist_directory, exist_ok=True)
+        # Document metadata as JSON, embeddings as an int8 .npy matrix plus per-row scales
         self.persist_path = os.path.join(persist_directory, "vector_store.json")
+        self.embeddings_path = os.path.join(persist_directory, "vector_store.npy")
+        self.scales_path = os.path.join(persist_directory, "vector_store_scales.npy")
+        self._save_lock = threading.Lock()
+
+        # Debounced persistence: bursts of writes coalesce into one save
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        atexit.register(self.flush)
 
         # Initialize embedding model (all-MiniLM-L6-v2 - fast and efficient)
         print("Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("Embedding model loaded successfully")
+        self.embedding_model, self.embedding_backend = self._load_embedding_model(settings.EMBEDDING_BACKEND)
+        print(f"Embedding model loaded successfully ({self.embedding_backend})")
+
+        # Repeated questions reuse their embedding instead of re-running the model
+        self._encode_cached = lru_cache(maxsize=1024)(self._encode_uncached)
 
-        # Load persisted data or start fresh
+        # Load persisted data or start fresh; row i of the matrix times
+        # scales[i] is the L2-normalized embedding of documents[i], stored as
+        # int8 for a quarter of the float32 memory and bandwidth
         self.documents: List[Dict[str, Any]] = []
-        self.embeddings: List[List[float]] = []
+        self._ann = None
+        self._ann_lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._reset_embeddings()
         self._load()
 
+    def _reset_embeddings(self):
+        """Empty the embedding matrix"""
+        self._set_rows(
+            np.empty((0, self.EMBEDDING_DIM), dtype=np.int8),
+            np.empty(0, dtype=np.float32)
+        )
+        self._intent_rows: Dict[str, np.ndarray] = {}
+        self._drop_ann_index()
+
+    def _rebuild_intent_index(self):
+        """Map each intent to the array of matrix rows holding it"""
+        buckets = defaultdict(list)
+        for row, doc in enumerate(self.documents[:len(self._matrix)]):
+            buckets[doc.get("intent")].append(row)
+        self._intent_rows = {intent: np.array(rows, dtype=np.intp) for intent, rows in buckets.items()}
+
+    def _index_intents(self, start: int, stop: int):
+        """Add rows start..stop-1 to the intent index"""
+        buckets = defaultdict(list)
+        for row in range(start, stop):
+            buckets[self.documents[row].get("intent")].append(row)
+        # Copy-on-write so concurrent searches never see a half-updated bucket
+        intent_rows = dict(self._intent_rows)
+        for intent, rows in buckets.items():
+            existing = intent_rows.get(intent)
+            added = np.array(rows, dtype=np.intp)
+            intent_rows[intent] = added if existing is None else np.concatenate((existing, added))
+        self._intent_rows = intent_rows
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        """L2-normalize each row in place (float32) so search is a single dot product"""
+        matrix /= np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None]
+        return matrix
+
+    @staticmethod
+    def _load_embedding_model(backend: str):
+        """
+        Load the sentence encoder, preferring ONNX Runtime when requested
+
+        The ONNX backend needs sentence-transformers>=3.2 with optimum/onnxruntime;
+        otherwise the torch model is used. Returns (model, backend name).
+        """
+        if backend == "onnx":
+            try:
+                return SentenceTransformer('all-MiniLM-L6-v2', backend="onnx"), "onnx"
+            except Exception as e:
+                print(f"[WARN] ONNX embedding backend unavailable ({e}), using torch")
+
+        import torch
+        torch.set_num_threads(settings.EMBEDDING_NUM_THREADS or os.cpu_count() or 4)
+        return SentenceTransformer('all-MiniLM-L6-v2'), "torch"
+
+    def _model_encode(self, sentences, **kwargs):
+        """Run the embedding model, without autograd bookkeeping on the torch backend"""
+        if self.embedding_backend == "torch":
+            import torch
+            with torch.inference_mode():
+                return self.embedding_model.encode(sentences, **kwargs)
+        return self.embedding_model.encode(sentences, **kwargs)
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Normalized float32 embeddings of several texts in one batched model call (not cached)"""
+        return np.asarray(
+            self._model_encode(
+                texts,
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ),
+            dtype=np.float32
+        )
+
+    def _encode_uncached(self, text: str) -> np.ndarray:
+        """Embed one text as a normalized, read-only float32 vector"""
+        # The model returns a fresh float32 array already normalized; no copies
+        embedding = np.asarray(
+            self._model_encode(text, convert_to_numpy=True, normalize_embeddings=True),
+            dtype=np.float32
+        )
+        embedding.flags.writeable = False
+        return embedding
+
+    def encode(self, text: str) -> np.ndarray:
+        """
+        Normalized float32 embedding of a text, cached per exact string
+
+        The returned array is shared and read-only.
+        """
+        return self._encode_cached(text)
+
+    def clear_encode_cache(self):
+        """Drop all cached embeddings"""
+        self._encode_cached.cache_clear()
+
+    @staticmethod
+    def _quantize_rows(matrix: np.ndarray):
+        """Quantize float rows to int8 with a per-row scale (row ~= int8_row * scale)"""
+        scales = (np.abs(matrix).max(axis=1) / 127.0).astype(np.float32)
+        scales[scales == 0] = 1.0
+        quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+        return quantized, scales
+
+    def _set_rows(self, matrix: np.ndarray, scales: np.ndarray):
+        """Replace the stored rows; the arrays become the (full) backing buffers"""
+        self._matrix_buf = matrix
+        self._scales_buf = scales
+        self._scales = scales
+        self._matrix = matrix
+
+    def _append_embeddings(self, normalized: np.ndarray, documents: Optional[List[Dict[str, Any]]] = None):
+        """
+        Quantize and append normalized embedding rows
+
+        _matrix and _scales are views over the first rows of larger buffers
+        that double in capacity when full, so appends are amortized O(1)
+        instead of copying the whole matrix each time.
+
+        Args:
+            normalized: Normalized float32 embeddings, one row per document
+            documents: Documents for these rows, appended under the same lock
+                so concurrent adds can't pair a document with another's row
+        """
+        quantized, scales = self._quantize_rows(normalized)
+        with self._append_lock:
+            if documents:
+                # Document first: concurrent searches only read rows that have a document
+                self.documents.extend(documents)
+            start = len(self._matrix)
+            needed = start + len(quantized)
+            if needed > len(self._matrix_buf):
+                capacity = max(needed, 2 * len(self._matrix_buf), 16)
+                matrix_buf = np.empty((capacity, self.EMBEDDING_DIM), dtype=np.int8)
+                scales_buf = np.empty(capacity, dtype=np.float32)
+                matrix_buf[:start] = self._matrix
+                scales_buf[:start] = self._scales
+                self._matrix_buf, self._scales_buf = matrix_buf, scales_buf
+
+            # Rows past the current views are invisible to searches until the
+            # views grow; scales first, since searches trim scales to the matrix
+            self._matrix_buf[start:needed] = quantized
+            self._scales_buf[start:needed] = scales
+            self._scales = self._scales_buf[:needed]
+            self._matrix = self._matrix_buf[:needed]
+            self._index_intents(start, needed)
+
+            # Still under _append_lock, so labels can't be reused by a delete in between
+            with self._ann_lock:
+                if self._ann is not None:
+                    if needed > self._ann.get_max_elements():
+                        self._ann.resize_index(max(needed, 2 * self._ann.get_max_elements()))
+                    self._ann.add_items(normalized, np.arange(start, needed))
+
+    def _drop_ann_index(self):
+        """Discard the HNSW index; it is rebuilt on the next large enough search"""
+        with self._ann_lock:
+            self._ann = None
+
+    def _ann_search(self, query: np.ndarray, k: int):
+        """
+        Approximate top-k rows via an HNSW index, built lazily from the matrix
+
+        Returns:
+            (row indices, cosine distances), nearest first
+        """
+        ann = self._ann
+        if ann is None:
+            # Appends and deletes are held off so no row change is missed by the build
+            with self._append_lock, self._ann_lock:
+                if self._ann is None:
+                    matrix = self._matrix
+                    vectors = matrix * self._scales[:len(matrix), None]
+                    ann = hnswlib.Index(space='cosine', dim=self.EMBEDDING_DIM)
+                    ann.init_index(max_elements=2 * len(vectors), ef_construction=200, M=16)
+                    ann.add_items(vectors, np.arange(len(vectors)))
+                    self._ann = ann
+                ann = self._ann
+        with self._ann_lock:
+            ann.set_ef(max(50, k))
+            labels, distances = ann.knn_query(query, k=min(k, ann.get_current_count()))
+        return labels[0], distances[0]
+
     def _load(self):
         """Load persisted data from disk"""
         if os.path.exists(self.persist_path):
             try:
-                with open(self.persist_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                with open(self.persist_path, 'rb') as f:
+                    raw = f.read()
+                data = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
                 self.documents = data.get("documents", [])
-                self.embeddings = data.get("embeddings", [])
+
+                if "embeddings" in data:
+                    # Legacy single-file layout; rewritten in the split layout below
+                    if data["embeddings"]:
+                        self._append_embeddings(self._normalize_rows(np.asarray(data["embeddings"], dtype=np.float32)))
+                    self._save_now()
+                elif os.path.exists(self.embeddings_path):
+                    # A plain binary read, no parsing
+                    matrix = np.load(self.embeddings_path)
+                    if matrix.dtype != np.int8:
+                        # Normalized float32 layout; quantize and rewrite
+                        self._append_embeddings(matrix.astype(np.float32))
+                        self._save_now()
+                    elif os.path.exists(self.scales_path):
+                        self._set_rows(matrix, np.load(self.scales_path))
+                        self._rebuild_intent_index()
+
+                if not len(self._matrix) == len(self._scales) == len(self.documents):
+                    print("[WARN] Vector store embeddings out of sync with documents, re-encoding")
+                    self._reencode_documents()
                 print(f"[OK] Loaded {len(self.documents)} examples from vector store")
             except Exception as e:
                 print(f"[WARN] Could not load vector store: {e}")
                 self.documents = []
-                self.embeddings = []
-
-    def _save(self):
-        """Persist data to disk"""
-        data = {
-            "documents": self.documents,
-            "embeddings": self.embeddings
+                self._reset_embeddings()
+
+    def _reencode_documents(self):
+        """Rebuild the embedding matrix from the stored questions"""
+        self._reset_embeddings()
+        if self.documents:
+            self._append_embeddings(self.encode_batch([doc["question"] for doc in self.documents]))
+        self._save_now()
+
+    def _save(self, delay: float = 0.5):
+        """Mark the store dirty and persist it after a short delay, coalescing bursts"""
+        with self._timer_lock:
+            self._dirty = True
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write pending changes to disk now"""
+        with self._timer_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            dirty = self._dirty
+        if dirty:
+            self._save_now()
+
+    def _save_now(self):
+        """Persist data to disk (embeddings first, each file replaced atomically)"""
+        with self._save_lock:
+            with self._timer_lock:
+                self._dirty = False
+            # Consistent copy: deletes rewrite rows in place
+            with self._append_lock:
+                matrix = self._matrix.copy()
+                scales = self._scales.copy()
+                documents = self.documents[:len(matrix)]
+
+            for path, array in ((self.scales_path, scales), (self.embeddings_path, matrix)):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+
+            tmp_path = self.persist_path + ".tmp"
+            if ORJSON_AVAILABLE:
+                payload = orjson.dumps({"documents": documents}, option=orjson.OPT_SERIALIZE_NUMPY)
+            else:
+                payload = json.dumps({"documents": documents}, ensure_ascii=False).encode('utf-8')
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.persist_path)
+
+    @staticmethod
+    def _build_document(
+        question: str,
+        sql: str,
+        intent: str,
+        metadata: Optional[Dict[str, Any]] = None,
+        added_at: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Build the stored document for an example"""
+        doc = {
+            # Random ids stay unique across deletes and same-tick bulk inserts
+            "id": f"query_{uuid4().hex}",
+            "question": question,
+            "sql": sql,
+            "intent": intent,
+            "added_at": added_at or datetime.now().isoformat()
         }
-        with open(self.persist_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
+        if metadata:
+            doc["metadata"] = metadata
+        return doc
 
     def add_query_example(
         self,
@@ -80,24 +465,13 @@ class VectorStore:
         Returns:
             Document ID
         """
-        doc_id = f"query_{len(self.documents)}_{datetime.now().timestamp()}"
-
         # Generate embedding
-        embedding = self.embedding_model.encode(question).tolist()
+        embedding = self.encode(question).reshape(1, -1)
 
-        # Build document
-        doc = {
-            "id": doc_id,
-            "question": question,
-            "sql": sql,
-            "intent": intent,
-            "added_at": datetime.now().isoformat()
-        }
-        if metadata:
-            doc["metadata"] = metadata
+        doc = self._build_document(question, sql, intent, metadata)
+        doc_id = doc["id"]
 
-        self.documents.append(doc)
-        self.embeddings.append(embedding)
+        self._append_embeddings(embedding, [doc])
         self._save()
 
         return doc_id
@@ -123,40 +497,64 @@ class VectorStore:
             return []
 
         # Generate query embedding
-        query_embedding = self.embedding_model.encode(question)
-
-        # Filter by intent if specified
-        indices = list(range(len(self.documents)))
+        query_norm = self.encode(question)
+
+        # Large unfiltered stores use the approximate index
+        if HNSWLIB_AVAILABLE and not intent_filter and len(self._matrix) >= self.ANN_MIN_EXAMPLES:
+            labels, distances = self._ann_search(query_norm, n_results)
+            return [self._to_result(self.documents[i], d) for i, d in zip(labels, distances)]
+
+        # Rows are pre-normalized, so cosine similarity is one matrix-vector product
+        # A delete shrinks the matrix before the scales; trim both to the shorter
+        matrix = self._matrix
+        scales = self._scales
+        n = min(len(matrix), len(scales))
+        matrix = matrix[:n]
+        scales = scales[:n]
+        rows = None
+        mask = None
+        candidates = len(matrix)
+
+        # Filter by intent if specified, via the precomputed row index
         if intent_filter:
-            indices = [i for i in indices if self.documents[i].get("intent") == intent_filter]
-
-        if not indices:
+            rows = self._intent_rows.get(intent_filter)
+            if rows is None:
+                return []
+            candidates = len(rows)
+            if candidates > self.INTENT_MASK_MIN_FRACTION * len(matrix):
+                # Dense bucket: skipping the other rows beats copying this many
+                mask = np.zeros(len(matrix), dtype=np.bool_)
+                mask[rows] = True
+                rows = None
+            else:
+                matrix = matrix[rows]
+                scales = scales[rows]
+
+        if not candidates or n_results <= 0:
             return []
 
-        # Compute cosine similarities
-        doc_embeddings = np.array([self.embeddings[i] for i in indices])
-        query_norm = query_embedding / np.linalg.norm(query_embedding)
-        doc_norms = doc_embeddings / np.linalg.norm(doc_embeddings, axis=1, keepdims=True)
-        similarities = doc_norms @ query_norm
-
         # Get top-n results
-        top_k = min(n_results, len(indices))
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-
-        results = []
-        for idx in top_indices:
-            orig_idx = indices[idx]
-            doc = self.documents[orig_idx]
-            results.append({
-                "id": doc["id"],
-                "question": doc["question"],
-                "sql": doc["sql"],
-                "intent": doc.get("intent", ""),
-                "distance": float(1 - similarities[idx]),  # Convert similarity to distance
-                "metadata": {k: v for k, v in doc.items() if k not in ("id", "question")}
-            })
+        top_k = min(n_results, candidates)
+        top_indices, similarities = _int8_top_k(matrix, scales, query_norm, top_k, mask)
+
+        # Convert similarity to distance
+        doc_rows = top_indices if rows is None else rows[top_indices]
+        return [
+            self._to_result(self.documents[row], 1 - similarity)
+            for row, similarity in zip(doc_rows, similarities)
+        ]
 
-        return results
+    @staticmethod
+    def _to_result(doc: Dict[str, Any], distance: float) -> Dict[str, Any]:
+        """Search result entry for a stored document"""
+        return {
+            "id": doc["id"],
+            "question": doc["question"],
+            "sql": doc["sql"],
+            "intent": doc.get("intent", ""),
+            "distance": float(distance),
+            "metadata": {k: v for k, v in doc.items() if k not in ("id", "question")}
+        }
 
     def get_all_examples(self) -> List[Dict[str, Any]]:
         """Get all query examples from the store"""
@@ -173,18 +571,54 @@ class VectorStore:
 
     def delete_example(self, doc_id: str) -> bool:
         """Delete a query example by ID"""
-        for i, doc in enumerate(self.documents):
-            if doc["id"] == doc_id:
-                self.documents.pop(i)
-                self.embeddings.pop(i)
-                self._save()
-                return True
-        return False
+        with self._append_lock:
+            last = len(self._matrix) - 1
+            for i, doc in enumerate(self.documents[:last + 1]):
+                if doc["id"] == doc_id:
+                    break
+            else:
+                return False
+
+            # Swap-with-last: move the final row into the hole instead of
+            # shifting every row after it
+            moved = self.documents[last]
+            self._matrix_buf[i] = self._matrix_buf[last]
+            self._scales_buf[i] = self._scales_buf[last]
+            self.documents[i] = moved
+
+            # Copy-on-write intent index, repointed before the views shrink
+            intent_rows = dict(self._intent_rows)
+            rows = intent_rows[doc.get("intent")]
+            rows = rows[rows != i]
+            if len(rows):
+                intent_rows[doc.get("intent")] = rows
+            else:
+                del intent_rows[doc.get("intent")]
+            if i != last:
+                rows = intent_rows[moved.get("intent")].copy()
+                rows[rows == last] = i
+                intent_rows[moved.get("intent")] = rows
+            self._intent_rows = intent_rows
+
+            # Matrix before scales, mirroring the grow order
+            self._matrix = self._matrix_buf[:last]
+            self._scales = self._scales_buf[:last]
+            del self.documents[last]
+
+            # Under _append_lock: an add can't reuse the last label before it is retired
+            with self._ann_lock:
+                if self._ann is not None:
+                    # HNSW labels are row numbers: relabel the moved vector, retire the last label
+                    if i != last:
+                        self._ann.add_items(self._matrix_buf[i:i + 1] * self._scales_buf[i], np.array([i]))
+                    self._ann.mark_deleted(last)
+        self._save()
+        return True
 
     def clear_all(self) -> bool:
         """Clear all examples from the store"""
         self.documents = []
-        self.embeddings = []
+        self._reset_embeddings()
         self._save()
         return True
 
@@ -199,34 +633,55 @@ class VectorStore:
             "total_examples": len(self.documents),
             "intents": intents,
             "embedding_model": "all-MiniLM-L6-v2",
-            "embedding_dimension": 384
+            "embedding_backend": self.embedding_backend,
+            "embedding_dimension": self.EMBEDDING_DIM
         }
 
     def bulk_add_examples(self, examples: List[Dict[str, Any]]) -> int:
-        """Add multiple query examples at once"""
-        count = 0
+        """
+        Add multiple query examples at once
+
+        All questions are embedded in one batched encode call and the store
+        is saved once at the end.
+        """
+        valid = []
         for example in examples:
-            try:
-                self.add_query_example(
-                    question=example['question'],
-                    sql=example['sql'],
-                    intent=example.get('intent', 'general_query'),
-                    metadata=example.get('metadata')
-                )
-                count += 1
-            except Exception as e:
-                print(f"Error adding example: {e}")
-                continue
-        return count
+            if 'question' in example and 'sql' in example:
+                valid.append(example)
+            else:
+                print(f"Error adding example: missing question or sql in {example!r}")
+        if not valid:
+            return 0
+
+        embeddings = self.encode_batch([example['question'] for example in valid])
+
+        added_at = datetime.now().isoformat()
+        docs = [
+            self._build_document(
+                example['question'],
+                example['sql'],
+                example.get('intent', 'general_query'),
+                example.get('metadata'),
+                added_at
+            )
+            for example in valid
+        ]
+
+        self._append_embeddings(embeddings, docs)
+        self._save_now()
+        return len(docs)
 
 
 # Global instance
 _vector_store = None
+_vector_store_init_lock = threading.Lock()
 
 
 def get_vector_store() -> VectorStore:
     """Get singleton vector store instance"""
     global _vector_store
     if _vector_store is None:
-        _vector_store = VectorStore()
+        with _vector_store_init_lock:
+            if _vector_store is None:
+                _vector_store = VectorStore()
     return _vector_store